@@ -0,0 +1,167 @@
+from token_utils import count_tokens_many
+from metrics import get_metrics
+from collections import deque
+from dataclasses import dataclass
+
+import os, threading, time
+
+# Budgets are in estimated tokens and, like the rate limits, per process
+ADMISSION_GLOBAL_BUDGET = int(os.getenv("ADMISSION_GLOBAL_BUDGET", "120000"))
+ADMISSION_CLIENT_BUDGET = int(os.getenv("ADMISSION_CLIENT_BUDGET", "40000"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+ADMISSION_MAX_QUESTIONS = int(os.getenv("ADMISSION_MAX_QUESTIONS", "60"))
+ADMISSION_MAX_CONTENT_LENGTH = int(os.getenv("ADMISSION_MAX_CONTENT_LENGTH", str(256 * 1024)))
+# Rules prompt plus expected completion for every graded text
+ADMISSION_CALL_OVERHEAD = int(os.getenv("ADMISSION_CALL_OVERHEAD", "1200"))
+ADMISSION_SECTION_TOKENS = int(os.getenv("COVER_LETTER_SECTION_TOKENS", "500"))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, outcome: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(reason)
+        self.outcome = outcome
+        self.retry_after = retry_after
+
+
+@dataclass
+class Admission:
+    client: str
+    cost: int
+    queue_wait: float
+
+
+def estimate_questions_cost(questions: list[dict]) -> int:
+    texts = [f"{q.get('question') or ''}\n{q.get('answer') or ''}" for q in questions]
+    return sum(count_tokens_many(texts)) + ADMISSION_CALL_OVERHEAD * len(texts)
+
+
+def estimate_letter_cost(body: str) -> int:
+    # Long letters are graded once per section plus once as a whole
+    tokens = count_tokens_many([body])[0]
+    calls = 1 + tokens // ADMISSION_SECTION_TOKENS
+    return 2 * tokens + ADMISSION_CALL_OVERHEAD * calls
+
+
+def record_admission(outcome: str) -> None:
+    get_metrics().inc("admission_total", "Requests seen by admission control", outcome=outcome)
+
+
+class AdmissionController:
+    # Requests reserve their estimated cost against a global and a per-client
+    # budget. A client over its own budget is turned away at once; otherwise
+    # requests wait in strict FIFO order for global capacity, up to
+    # `queue_timeout` seconds and `max_queue` waiters.
+    def __init__(
+        self,
+        global_budget: int = ADMISSION_GLOBAL_BUDGET,
+        client_budget: int = ADMISSION_CLIENT_BUDGET,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.global_budget = global_budget
+        self.client_budget = client_budget
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # In flight plus queued, so one client cannot fill the queue
+        self.by_client = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _reserve_client(self, client: str, cost: int):
+        if self.by_client.get(client, 0) + cost > self.client_budget:
+            raise AdmissionRejected("Too much work in flight for this client", "rejected_client")
+        self.by_client[client] = self.by_client.get(client, 0) + cost
+
+    def _release_client(self, client: str, cost: int):
+        remaining = self.by_client.get(client, 0) - cost
+        if remaining > 0:
+            self.by_client[client] = remaining
+        else:
+            self.by_client.pop(client, None)
+
+    def acquire(self, client: str, cost: int) -> Admission:
+        try:
+            return self._acquire(client, cost)
+        except AdmissionRejected as e:
+            record_admission(e.outcome)
+            raise
+
+    def _acquire(self, client: str, cost: int) -> Admission:
+        # A single request larger than a budget still runs, just on its own
+        cost = max(1, min(cost, self.client_budget, self.global_budget))
+        start = time.monotonic()
+        with self._cond:
+            self._reserve_client(client, cost)
+
+            if not self._queue and self.in_flight + cost <= self.global_budget:
+                self.in_flight += cost
+                record_admission("admitted")
+                return Admission(client, cost, 0.0)
+
+            if len(self._queue) >= self.max_queue:
+                self._release_client(client, cost)
+                raise AdmissionRejected("Server is at capacity", "rejected_queue_full")
+
+            ticket = object()
+            self._queue.append(ticket)
+            deadline = start + self.queue_timeout
+            try:
+                while self._queue[0] is not ticket or self.in_flight + cost > self.global_budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._release_client(client, cost)
+                        raise AdmissionRejected(
+                            "Timed out waiting for capacity", "rejected_timeout"
+                        )
+                    self._cond.wait(remaining)
+                self.in_flight += cost
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+        queue_wait = time.monotonic() - start
+        record_admission("queued")
+        get_metrics().observe(
+            "admission_queue_wait_seconds", "Time requests waited for capacity", queue_wait
+        )
+        return Admission(client, cost, queue_wait)
+
+    def release(self, admission: Admission):
+        with self._cond:
+            self.in_flight -= admission.cost
+            self._release_client(admission.client, admission.cost)
+            self._cond.notify_all()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+get_metrics().register_callback(
+    "admission_in_flight_tokens",
+    "gauge",
+    "Estimated tokens of admitted requests still running",
+    lambda: get_admission_controller().in_flight,
+)
+get_metrics().register_callback(
+    "admission_queue_depth",
+    "gauge",
+    "Requests waiting for capacity",
+    lambda: get_admission_controller().queue_depth,
+)
@@ -1,4 +1,13 @@
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import (
+    Flask,
+    Response,
+    request,
+    jsonify,
+    send_from_directory,
+    make_response,
+    stream_with_context,
+    g,
+)
 from flask_cors import CORS
 import uuid
 import os
@@ -6,21 +15,135 @@ import time
 import json
 from datetime import timedelta
 
-from asylum_check import check_answers_and_give_feedback, check_full_cover_letter, FormQuestion, CoverLetter
+from asylum_check import (
+    check_answers_and_give_feedback,
+    check_full_cover_letter,
+    iter_checked_drafts,
+    make_feedback,
+    FormQuestion,
+    CoverLetter,
+)
+from metrics import get_metrics, get_request_usage, record_http_request, start_request_usage
+from warmup import get_readiness, is_ready, warm_up
+from admission import (
+    ADMISSION_MAX_CONTENT_LENGTH,
+    ADMISSION_MAX_QUESTIONS,
+    AdmissionRejected,
+    estimate_letter_cost,
+    estimate_questions_cost,
+    get_admission_controller,
+)
+from job_queue import JobQueueFull, get_job_queue
+
 IS_PRODUCTION = os.getenv("ENV") == "production"
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 API_URL = os.getenv("API_URL")
+# Attach each request's LLM usage to its JSON feedback unless ?include_usage=false
+ATTACH_USAGE_SUMMARY = os.getenv("ATTACH_USAGE_SUMMARY", "false").lower() == "true"
 
 app = Flask(__name__)
+# Oversized bodies are refused with a 413 before they are parsed
+app.config["MAX_CONTENT_LENGTH"] = ADMISSION_MAX_CONTENT_LENGTH
 print("FRONTEND_URL", FRONTEND_URL)
 # CORS(app, supports_credentials=True, origins=FRONTEND_URL)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins
 
 
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    start_request_usage(request.path)
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    duration = time.perf_counter() - g.request_start
+    record_http_request(route, request.method, response.status_code, duration)
+    return response
+
+
+def get_client_id() -> str:
+    # fly.io's proxy puts the caller's address in Fly-Client-IP. X-Forwarded-For
+    # is never used: the client controls it, and rotating it would buy a fresh
+    # admission budget and job quota on every request.
+    if request.headers.get("Fly-Client-IP"):
+        return request.headers["Fly-Client-IP"]
+    return request.remote_addr
+
+
+def estimate_request_cost(data: dict):
+    if request.endpoint == "coverletter":
+        return estimate_letter_cost(str(data.get("body") or ""))
+    questions = data.get("questions")
+    if not isinstance(questions, list):
+        return None
+    if len(questions) > ADMISSION_MAX_QUESTIONS:
+        raise ValueError(f"Too many questions, at most {ADMISSION_MAX_QUESTIONS} per request")
+    return estimate_questions_cost([q for q in questions if isinstance(q, dict)])
+
+
+ADMITTED_ENDPOINTS = {"coverletter", "gradequestions", "gradequestions_stream"}
+
+
+@app.before_request
+def admit_request():
+    # Grading routes reserve their estimated cost before doing any model work,
+    # and queue briefly or get a 429 when the worker is at capacity
+    if request.endpoint not in ADMITTED_ENDPOINTS:
+        return None
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None
+
+    try:
+        cost = estimate_request_cost(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    if cost is None:
+        return None
+
+    try:
+        g.admission = get_admission_controller().acquire(get_client_id(), cost)
+    except AdmissionRejected as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+
+@app.teardown_request
+def release_admission(exc):
+    admission = g.pop("admission", None)
+    if admission is not None:
+        get_admission_controller().release(admission)
+
+
+def include_usage() -> bool:
+    value = request.args.get("include_usage")
+    if value is None:
+        return ATTACH_USAGE_SUMMARY
+    return value.lower() in ("1", "true", "yes")
+
+
 @app.route("/")
 def main():
     return jsonify({"message": "Hello, World!"})
 
+
+@app.route("/metrics")
+def metrics():
+    return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/ready")
+def ready():
+    # gunicorn warms every worker before it takes traffic (see gunicorn.conf.py);
+    # under any other server the first probe does it
+    readiness = get_readiness() if is_ready() else warm_up()
+    return jsonify(readiness), 200 if readiness["ready"] else 503
+
+
 @app.route("/coverletter", methods=["POST"])
 def coverletter():
     data = request.get_json()
@@ -34,6 +157,8 @@ def coverletter():
 
         # Verify the cover letter
         feedback = check_full_cover_letter(letter)
+        if include_usage():
+            feedback["usage"] = get_request_usage().to_dict()
 
         # Return the listing in JSON
         return jsonify(feedback)
@@ -54,10 +179,143 @@ def gradequestions():
             for q in data["questions"]
         ]
 
-        # Verify the answers
-        feedback = check_answers_and_give_feedback(form_questions)
+        # Verify the answers, regrading only what changed if the client sent a form_id
+        feedback = check_answers_and_give_feedback(form_questions, data.get("form_id"))
+        if include_usage():
+            feedback = {"feedback": feedback, "usage": get_request_usage().to_dict()}
 
         # Return the listing in JSON
         return jsonify(feedback)
     else:
         return jsonify({"error": "Invalid input. Expected a list of file paths."}), 400
+
+
+@app.route("/gradequestions/stream", methods=["POST"])
+def gradequestions_stream():
+    data = request.get_json()
+
+    print(data)
+
+    if "questions" in data:
+
+        # Create FormQuestion objects from the json
+        form_questions = [
+            FormQuestion(q["question"], q["specific_rules"], q["answer"], None, False)
+            for q in data["questions"]
+        ]
+
+        # Emit one NDJSON record per question as soon as it is graded, then a summary
+        def generate():
+            start = time.perf_counter()
+            tokens_in = tokens_out = 0
+
+            checked = iter_checked_drafts(form_questions, data.get("form_id"))
+            for i, question_in, question_out in checked:
+                tokens_in += question_in
+                tokens_out += question_out
+                record = {"index": i, **make_feedback(form_questions[i])}
+                yield json.dumps(record) + "\n"
+
+            summary = {
+                "questions": len(form_questions),
+                "finalized": sum(q.finalized for q in form_questions),
+                "tokens_in": tokens_in,
+                "tokens_out": tokens_out,
+                "elapsed": time.perf_counter() - start,
+                "usage": get_request_usage().to_dict(),
+            }
+            yield json.dumps({"summary": summary}) + "\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    else:
+        return jsonify({"error": "Invalid input. Expected a list of file paths."}), 400
+
+
+def grade_questions_job(data: dict) -> list:
+    form_questions = [
+        FormQuestion(q["question"], q["specific_rules"], q["answer"], None, False)
+        for q in data["questions"]
+    ]
+    return check_answers_and_give_feedback(form_questions, data.get("form_id"))
+
+
+def cover_letter_job(data: dict) -> dict:
+    return check_full_cover_letter(CoverLetter(data["body"], [], None, False))
+
+
+get_job_queue().register("gradequestions", "questions", grade_questions_job)
+get_job_queue().register("coverletter", "cover_letter", cover_letter_job)
+
+
+def submit_job(kind: str, data: dict):
+    # Under gunicorn the workers start in post_fork; this covers other servers
+    job_queue = get_job_queue()
+    job_queue.start()
+    try:
+        job_id = job_queue.submit(kind, data, get_client_id())
+    except JobQueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+
+def is_valid_question(q) -> bool:
+    # Everything grade_questions_job reads, checked before the job is accepted
+    return (
+        isinstance(q, dict)
+        and isinstance(q.get("question"), str)
+        and isinstance(q.get("answer"), str)
+        and isinstance(q.get("specific_rules"), list)
+    )
+
+
+@app.route("/jobs/gradequestions", methods=["POST"])
+def submit_gradequestions_job():
+    data = request.get_json()
+
+    if not isinstance(data.get("questions"), list):
+        return jsonify({"error": "Invalid input. Expected a list of questions."}), 400
+    if len(data["questions"]) > ADMISSION_MAX_QUESTIONS:
+        error = f"Too many questions, at most {ADMISSION_MAX_QUESTIONS} per request"
+        return jsonify({"error": error}), 413
+    invalid = [i for i, q in enumerate(data["questions"]) if not is_valid_question(q)]
+    if invalid:
+        error = (
+            "Invalid input. Every question needs a question, an answer and a list of "
+            f"specific_rules; see questions {invalid}."
+        )
+        return jsonify({"error": error}), 400
+
+    return submit_job(
+        "gradequestions", {"questions": data["questions"], "form_id": data.get("form_id")}
+    )
+
+
+@app.route("/jobs/coverletter", methods=["POST"])
+def submit_coverletter_job():
+    data = request.get_json()
+
+    if not isinstance(data.get("body"), str):
+        return jsonify({"error": "Invalid input. Expected a cover letter body."}), 400
+
+    return submit_job("coverletter", {"body": data["body"]})
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    # ?wait=N holds the request until the job finishes or N seconds pass, if a
+    # long-poll slot is free (see JOB_MAX_LONG_POLLS)
+    get_job_queue().start()
+    wait = request.args.get("wait", type=float, default=0)
+    job = get_job_queue().wait(job_id, wait) if wait > 0 else get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job)
@@ -1,9 +1,61 @@
 from openai_utils import *
 from pydantic import BaseModel
-from asylum_ruleset import make_rules_short_answer, make_cover_letter_rules
+from asylum_ruleset import (
+    Rule,
+    RuleSet,
+    hash_rules,
+    SHORT_ANSWER_RULES,
+    COVER_LETTER_RULES,
+    COVER_LETTER_SECTION_RULES,
+    COVER_LETTER_WIDE_RULES,
+)
+from grading_cache import get_grading_cache, make_cache_key
+from similarity_cache import SIMILARITY_CACHE_MODE, get_similarity_cache
+from draft_store import get_draft_store
+from rule_index import select_rules
+from model_routing import call_routed, fixed_policy, get_routing_policy
+from prescreen import (
+    PrescreenFlag,
+    PRESCREEN_MODE,
+    PRESCREEN_MODEL,
+    PRESCREEN_HIGH_CONFIDENCE,
+    PRESCREEN_MEDIUM_CONFIDENCE,
+    prescreen_answer,
+    prescreen_confidence,
+)
+from metrics import get_metrics
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextvars import copy_context
+from functools import lru_cache
 
-import json, sys
+import json, os, re, sys, time
+
+# Bounded worker pool shared by every grading batch in the process, so concurrent
+# requests cannot fan out more than GRADING_MAX_WORKERS model calls at once.
+GRADING_MAX_WORKERS = int(os.getenv("GRADING_MAX_WORKERS", "8"))
+GRADING_BATCH_TIMEOUT = float(os.getenv("GRADING_BATCH_TIMEOUT", "90"))
+
+# Batched mode packs several questions that share a rule set into one model call
+GRADING_BATCH_MODE = os.getenv("GRADING_BATCH_MODE", "false").lower() == "true"
+GRADING_BATCH_TOKEN_BUDGET = int(os.getenv("GRADING_BATCH_TOKEN_BUDGET", "3000"))
+GRADING_BATCH_MAX_QUESTIONS = int(os.getenv("GRADING_BATCH_MAX_QUESTIONS", "8"))
+
+# Cover letters longer than this are split into sections of about
+# COVER_LETTER_SECTION_TOKENS and graded concurrently
+COVER_LETTER_SECTION_THRESHOLD = int(os.getenv("COVER_LETTER_SECTION_THRESHOLD", "1500"))
+COVER_LETTER_SECTION_TOKENS = int(os.getenv("COVER_LETTER_SECTION_TOKENS", "500"))
+
+GRADING_MODEL = "gpt-4o-2024-08-06"
+GRADING_TEMPERATURE = 0.1
+
+_grading_pool = ThreadPoolExecutor(max_workers=GRADING_MAX_WORKERS, thread_name_prefix="grading")
+
+
+def submit_grading(fn, *args):
+    # Run under a copy of the caller's context so model calls made on pool
+    # threads are still attributed to the request that submitted them
+    return _grading_pool.submit(copy_context().run, fn, *args)
 
 
 class AnswerReason(BaseModel):
@@ -38,6 +90,7 @@ class FormQuestion:
     answer: str
     answer_evaluation: AnswerReason
     finalized: bool
+    prescreen_flags: list[PrescreenFlag] = None
 
 
 def make_question_from_json(json_question: dict) -> FormQuestion:
@@ -50,6 +103,14 @@ def make_question_from_json(json_question: dict) -> FormQuestion:
     )
 
 
+class IndexedAnswerReason(AnswerReason):
+    index: int
+
+
+class AnswerReasons(BaseModel):
+    evaluations: list[IndexedAnswerReason]
+
+
 class InformationRequest(BaseModel):
     question: str
     reasoning: str
@@ -59,38 +120,245 @@ class InformationRequests(BaseModel):
     requests: list[InformationRequest]
 
 
-def check_answer(question: FormQuestion) -> bool:
+ANSWER_REASON_SCHEMA = json.dumps(AnswerReason.model_json_schema(), sort_keys=True)
+ANSWER_REASONS_SCHEMA = json.dumps(AnswerReasons.model_json_schema(), sort_keys=True)
+
+
+def select_default_rules(question: FormQuestion) -> RuleSet:
+    # With RULE_SELECTION_TOP_K set, only the rules relevant to this answer
+    return select_rules(SHORT_ANSWER_RULES, f"{question.question}\n{question.answer}")
 
+
+def resolve_rules(question: FormQuestion) -> str:
     if question.specific_rules is not None and len(question.specific_rules) > 0:
-        rules = "\n ".join(question.specific_rules)
-    else:
-        rules = make_rules_short_answer()
+        return "\n ".join(question.specific_rules)
+    return select_default_rules(question).rendered
 
-    system_prompt = (
-        "Your job is to determine if the following question is "
-        "answered sufficiently. Respond with true or false for "
-        "whether the answer is violating one of the rules, "
-        "missing info (i.e. not answering the question), saying too "
-        "much info, or providing irrelevant information. More than one "
-        "can be true. "
-        "Here are the rules that the answer should follow:\n"
-        f"Rules: {rules}\n"
-        "End of rules."
-        "Not every rule must be followed if that would cause contridiction. "
-        "For example, if the answer is short and references back to the cover letter, "
-        "it is not necessary to satisfy all other inclusion-specific rules "
-        "because they are likely satisfied by the cover letter. "
-    )
 
-    system_message = make_message("system", system_prompt)
+def resolve_rules_hash(question: FormQuestion) -> str:
+    # Stands in for the rules in cache keys, so a rules change or a
+    # RULESET_VERSION bump misses every grade cached under the old ones
+    if question.specific_rules is not None and len(question.specific_rules) > 0:
+        return hash_rules([Rule("specific", text) for text in question.specific_rules])
+    return select_default_rules(question).hash
+
+
+# The static instructions come first and the rules block next, so every call on
+# the same rule set shares a byte-identical leading prefix that the provider can
+# serve from its prompt cache. Only the question and answer vary, and they go last.
+CHECK_ANSWER_INSTRUCTIONS = (
+    "Your job is to determine if the following question is "
+    "answered sufficiently. Respond with true or false for "
+    "whether the answer is violating one of the rules, "
+    "missing info (i.e. not answering the question), saying too "
+    "much info, or providing irrelevant information. More than one "
+    "can be true. "
+    "Not every rule must be followed if that would cause contridiction. "
+    "For example, if the answer is short and references back to the cover letter, "
+    "it is not necessary to satisfy all other inclusion-specific rules "
+    "because they are likely satisfied by the cover letter. "
+    "Here are the rules that the answer should follow:\n"
+)
+
+
+# System prompts depend only on the rules text, so each distinct rule set is
+# rendered once and every later question reuses the identical string.
+@lru_cache(maxsize=128)
+def make_check_answer_prompt(rules: str) -> str:
+    return CHECK_ANSWER_INSTRUCTIONS + f"Rules: {rules}\n" "End of rules."
+
+
+def make_check_answer_messages(question: FormQuestion) -> list[dict]:
+
+    system_message = make_message("system", make_check_answer_prompt(resolve_rules(question)))
 
     user_prompt = f"Question: {question.question}\n" f"Answer: {question.answer}\n"
     user_message = make_message("user", user_prompt)
 
-    response: AnswerReason
-    response, _, _, reason = call_gpt_formatted([system_message, user_message], AnswerReason)
+    return [system_message, user_message]
+
+
+def evaluation_cache_key(question: FormQuestion, model: str = GRADING_MODEL) -> str:
+    return make_cache_key(
+        question.question,
+        question.answer,
+        resolve_rules_hash(question),
+        model,
+        GRADING_TEMPERATURE,
+        ANSWER_REASON_SCHEMA,
+    )
+
+
+def batch_cache_key(question: FormQuestion) -> str:
+    # Grades from the joint batch prompt come from a different prompt and
+    # schema than single-question grading, so they get a slot of their own
+    return make_cache_key(
+        question.question,
+        question.answer,
+        resolve_rules_hash(question),
+        f"batch:{GRADING_MODEL}",
+        GRADING_TEMPERATURE,
+        ANSWER_REASONS_SCHEMA,
+    )
+
+
+get_metrics().register_callback(
+    "grading_cache_hits_total",
+    "counter",
+    "Answer grades served from the grading cache",
+    lambda: get_grading_cache().hits,
+)
+get_metrics().register_callback(
+    "grading_cache_misses_total",
+    "counter",
+    "Answer grades not found in the grading cache",
+    lambda: get_grading_cache().misses,
+)
+
+
+def lookup_evaluation(key: str):
+    cached = get_grading_cache().get(key)
+    if cached is not None:
+        return AnswerReason(**cached), 0, 0, None
+    return None
+
+
+def store_evaluation(key: str, result) -> None:
+    response = result[0]
+    if response:
+        get_grading_cache().set(key, response.model_dump())
+
+
+def similarity_namespace(question: FormQuestion, model: str = GRADING_MODEL) -> str:
+    # Near-duplicate answers only share grades under the same question, rules and model
+    return make_cache_key(
+        question.question,
+        "",
+        resolve_rules_hash(question),
+        model,
+        GRADING_TEMPERATURE,
+        ANSWER_REASON_SCHEMA,
+    )
+
+
+def lookup_similar_evaluation(question: FormQuestion, namespace: str):
+    # A grade served from a near-duplicate answer, and the match itself for
+    # shadow mode to compare with the model's grade
+    similar = get_similarity_cache().lookup(namespace, question.answer)
+    if similar is not None and SIMILARITY_CACHE_MODE == "on":
+        return (AnswerReason(**similar), 0, 0, None), similar
+    return None, similar
+
+
+def store_similar_evaluation(question: FormQuestion, namespace: str, result, similar) -> None:
+    response = result[0]
+    if not response:
+        return
+    if similar is not None:
+        get_similarity_cache().record_shadow(
+            answer_flags(AnswerReason(**similar)) == answer_flags(response)
+        )
+    get_similarity_cache().add(namespace, question.answer, response.model_dump())
+
+
+def screen_question(question: FormQuestion) -> list[PrescreenFlag]:
+    # The matchers encode the default short-answer rules, so answers graded
+    # against question-specific rules are left to the model
+    if PRESCREEN_MODE == "off" or question.specific_rules:
+        return []
+    return prescreen_answer(question)
+
+
+def make_prescreen_evaluation(flags: list[PrescreenFlag]) -> AnswerReason:
+    confident = [flag for flag in flags if flag.confidence >= PRESCREEN_HIGH_CONFIDENCE]
+    if PRESCREEN_MODE != "on" or not confident:
+        return None
+    return AnswerReason(
+        rule_violation=any(flag.field == "rule_violation" for flag in confident),
+        missing_info=any(flag.field == "missing_info" for flag in confident),
+        said_too_much=False,
+        irrelevant_info=False,
+        reasoning=" ".join(flag.reason for flag in confident),
+    )
+
+
+def record_prescreen(outcome: str) -> None:
+    get_metrics().inc("prescreen_total", "Answers checked by the local pre-screen", outcome=outcome)
+
+
+def screen_for_grading(question: FormQuestion):
+    # Returns the pre-screen flags, the pre-screen verdict if it is confident
+    # enough to stand in for the model, and otherwise the model the answer
+    # should be graded on, or None to route it like any other answer
+    flags = screen_question(question)
+    verdict = make_prescreen_evaluation(flags)
+    if verdict is not None:
+        return flags, verdict, None
+
+    if PRESCREEN_MODE == "on" and prescreen_confidence(flags) >= PRESCREEN_MEDIUM_CONFIDENCE:
+        return flags, None, PRESCREEN_MODEL
+    return flags, None, None
+
 
-    if response is None:
+def prescreen_evaluation(question: FormQuestion):
+    flags, verdict, model = screen_for_grading(question)
+    if verdict is not None:
+        record_prescreen("answered")
+    elif model is not None:
+        record_prescreen("cheap_model")
+    else:
+        record_prescreen("flagged" if flags else "passed")
+    return verdict, model
+
+
+def answer_flags(response: AnswerReason) -> tuple:
+    return (
+        response.rule_violation,
+        response.missing_info,
+        response.said_too_much,
+        response.irrelevant_info,
+    )
+
+
+def grading_policy(endpoint: str, model: str):
+    return get_routing_policy(endpoint) if model is None else fixed_policy(model)
+
+
+def evaluate_answer(question: FormQuestion, endpoint: str = "check_answer"):
+    verdict, model = prescreen_evaluation(question)
+    if verdict is not None:
+        return verdict, 0, 0, None
+
+    policy = grading_policy(endpoint, model)
+    key = evaluation_cache_key(question, policy.tag)
+    cached = lookup_evaluation(key)
+    if cached is not None:
+        return cached
+    namespace = similarity_namespace(question, policy.tag)
+    served, similar = lookup_similar_evaluation(question, namespace)
+    if served is not None:
+        return served
+
+    result = call_routed(
+        make_check_answer_messages(question),
+        AnswerReason,
+        endpoint,
+        GRADING_TEMPERATURE,
+        agreement_key=answer_flags,
+        policy=policy,
+    )
+    store_evaluation(key, result)
+    store_similar_evaluation(question, namespace, result, similar)
+    return result
+
+
+def apply_evaluation(question: FormQuestion, response: AnswerReason, reason) -> bool:
+
+    # Cheap enough to recompute here, which keeps every write to the question
+    # on the thread that applies the result
+    question.prescreen_flags = screen_question(question)
+
+    if not response:
         print(f"Error from OpenAI:\n {reason}\n")
         question.finalized = False
 
@@ -106,10 +374,17 @@ def check_answer(question: FormQuestion) -> bool:
     return question.finalized
 
 
-def create_info_requests(question: FormQuestion) -> list[InformationRequest]:
+def check_answer(question: FormQuestion, endpoint: str = "check_answer") -> bool:
 
-    specific_rules = "\n ".join(question.specific_rules)
-    system_prompt = (
+    response: AnswerReason
+    response, _, _, reason = evaluate_answer(question, endpoint)
+
+    return apply_evaluation(question, response, reason)
+
+
+@lru_cache(maxsize=128)
+def make_info_request_prompt(specific_rules: str, rules: str = SHORT_ANSWER_RULES.rendered) -> str:
+    return (
         "Your job is to determine what additional information is needed "
         "to make the answer sufficient. Respond with the questions that "
         "need to be answered and the reasoning for why each is needed. "
@@ -117,37 +392,288 @@ def create_info_requests(question: FormQuestion) -> list[InformationRequest]:
         "in case those are relevant to the additional information needed. "
         "Be explicit about what information is missing or needed. "
         "Here are the rules that the answer must follow:\n"
-        f"Rules: {make_rules_short_answer()}\n"
+        f"Rules: {rules}\n"
         f"{specific_rules}\n"
     )
-    system_message = make_message("system", system_prompt)
+
+
+def make_info_request_messages(question: FormQuestion) -> list[dict]:
+
+    specific_rules = "\n ".join(question.specific_rules)
+    rules = select_default_rules(question).rendered
+    system_message = make_message("system", make_info_request_prompt(specific_rules, rules))
 
     user_prompt = f"Question: {question.question}\n" f"Answer: {question.answer}\n"
     user_message = make_message("user", user_prompt)
 
-    messages = [system_message, user_message]
+    return [system_message, user_message]
 
-    response: InformationRequests
-    response, _, _, reason = call_gpt_formatted(messages, InformationRequests)
 
-    if response is None:
+def unpack_requests(response: InformationRequests, reason) -> list[InformationRequest]:
+
+    if not response:
         print(f"Error from OpenAI:\n {reason}\n")
-        requests = []
+        return []
 
-    else:
-        requests = response.requests
+    return response.requests
+
+
+def create_info_requests(question: FormQuestion) -> list[InformationRequest]:
+
+    messages = make_info_request_messages(question)
+
+    response: InformationRequests
+    response, _, _, reason = call_routed(messages, InformationRequests, "info_requests")
+
+    return unpack_requests(response, reason)
+
+
+def _evaluate_isolated(question: FormQuestion, endpoint: str = "check_answer"):
+    # A failure grading one question must not take down the rest of the batch
+    try:
+        return evaluate_answer(question, endpoint)
+    except Exception as e:
+        return None, 0, 0, f"{type(e).__name__}: {e}"
 
-    return requests
 
+def check_all_answers(
+    questions: list[FormQuestion],
+    timeout: float = GRADING_BATCH_TIMEOUT,
+    batched: bool = GRADING_BATCH_MODE,
+) -> list[FormQuestion]:
+
+    if batched:
+        return check_all_answers_batched(questions, timeout)
+
+    for _ in iter_checked_answers(questions, timeout):
+        pass
 
-def check_all_answers(questions: list[FormQuestion]) -> list[FormQuestion]:
-    for question in questions:
-        if not question.finalized:
-            check_answer(question)
     return questions
 
 
-def reduce_requests(requests: list[InformationRequest]) -> InformationRequests:
+def iter_checked_answers(questions: list[FormQuestion], timeout: float = GRADING_BATCH_TIMEOUT):
+
+    # Yields (index, tokens_in, tokens_out) for every question as soon as its
+    # grade is applied. Questions that are already finalized come out first.
+    for i, question in enumerate(questions):
+        if question.finalized:
+            yield i, 0, 0
+
+    # Fan the model calls out over the shared pool. Results are applied on the
+    # consuming thread, so the questions are only ever mutated here.
+    futures = {
+        submit_grading(_evaluate_isolated, question): i
+        for i, question in enumerate(questions)
+        if not question.finalized
+    }
+
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            response, tokens_in, tokens_out, reason = future.result()
+            apply_evaluation(questions[futures[future]], response, reason)
+            yield futures[future], tokens_in, tokens_out
+
+    except TimeoutError:
+        for future in list(pending):
+            pending.discard(future)
+            future.cancel()
+            reason = f"Grading did not finish within {timeout}s"
+            apply_evaluation(questions[futures[future]], None, reason)
+            yield futures[future], 0, 0
+
+    finally:
+        # The consumer went away (e.g. a dropped stream), stop queued work
+        for future in pending:
+            future.cancel()
+
+
+CHECK_ANSWERS_BATCH_INSTRUCTIONS = (
+    "Your job is to determine if each of the following numbered questions is "
+    "answered sufficiently. Evaluate every question independently and return "
+    "exactly one evaluation per question, using the question number as its index. "
+    "For each one, respond with true or false for "
+    "whether the answer is violating one of the rules, "
+    "missing info (i.e. not answering the question), saying too "
+    "much info, or providing irrelevant information. More than one "
+    "can be true. "
+    "Not every rule must be followed if that would cause contridiction. "
+    "For example, if the answer is short and references back to the cover letter, "
+    "it is not necessary to satisfy all other inclusion-specific rules "
+    "because they are likely satisfied by the cover letter. "
+    "Here are the rules that every answer should follow:\n"
+)
+
+
+@lru_cache(maxsize=128)
+def make_check_answers_batch_prompt(rules: str) -> str:
+    return CHECK_ANSWERS_BATCH_INSTRUCTIONS + f"Rules: {rules}\n" "End of rules."
+
+
+def make_check_answers_batch_messages(questions: list[FormQuestion]) -> list[dict]:
+
+    # Every question in a batch shares the same rules, see plan_answer_batches
+    system_prompt = make_check_answers_batch_prompt(resolve_rules(questions[0]))
+    system_message = make_message("system", system_prompt)
+
+    user_prompt = "".join(
+        f"Question {i}: {question.question}\n" f"Answer {i}: {question.answer}\n\n"
+        for i, question in enumerate(questions)
+    )
+    user_message = make_message("user", user_prompt)
+
+    return [system_message, user_message]
+
+
+def plan_answer_batches(questions: list[FormQuestion], indexes: list[int]) -> list[list[int]]:
+
+    # Group by rule set, then pack each group greedily up to the token budget
+    groups = {}
+    for i in indexes:
+        groups.setdefault(resolve_rules(questions[i]), []).append(i)
+
+    batches = []
+    for group in groups.values():
+        texts = [questions[i].question + "\n" + questions[i].answer for i in group]
+
+        # Byte-length upper bounds are enough when the whole group clearly fits
+        token_counts = [estimate_tokens(text) for text in texts]
+        if sum(token_counts) > GRADING_BATCH_TOKEN_BUDGET:
+            token_counts = count_tokens_many(texts, GRADING_MODEL)
+
+        batch, batch_tokens = [], 0
+        for i, tokens in zip(group, token_counts):
+            if batch and (
+                batch_tokens + tokens > GRADING_BATCH_TOKEN_BUDGET
+                or len(batch) >= GRADING_BATCH_MAX_QUESTIONS
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+
+    return batches
+
+
+def unpack_answer_batch(response: AnswerReasons, tokens_in, tokens_out, reason, size: int):
+
+    # Anything short of exactly one evaluation per question is treated as a
+    # failed batch, and the caller falls back to grading questions one by one
+    if not response:
+        return None
+
+    by_index = {evaluation.index: evaluation for evaluation in response.evaluations}
+    if len(response.evaluations) != size or set(by_index) != set(range(size)):
+        return None
+
+    return [
+        (
+            AnswerReason(**by_index[i].model_dump(exclude={"index"})),
+            tokens_in // size,
+            tokens_out // size,
+            None,
+        )
+        for i in range(size)
+    ]
+
+
+def store_answer_batch(questions: list[FormQuestion], results) -> None:
+    if results is not None:
+        for question, result in zip(questions, results):
+            store_evaluation(batch_cache_key(question), result)
+
+
+def evaluate_answer_batch(questions: list[FormQuestion]):
+
+    if len(questions) == 1:
+        return [evaluate_answer(questions[0])]
+
+    try:
+        result = call_gpt_formatted(
+            make_check_answers_batch_messages(questions),
+            AnswerReasons,
+            model=GRADING_MODEL,
+            temp=GRADING_TEMPERATURE,
+            endpoint="check_answer_batch",
+        )
+    except Exception as e:
+        print(f"Error from OpenAI:\n {type(e).__name__}: {e}\n")
+        return None
+
+    results = unpack_answer_batch(*result, len(questions))
+    store_answer_batch(questions, results)
+    return results
+
+
+def lookup_cached_answers(questions: list[FormQuestion]):
+    results, misses = {}, []
+    for i, question in enumerate(questions):
+        if question.finalized:
+            continue
+        # Medium-confidence flags are still graded in batches on the grading model
+        verdict = make_prescreen_evaluation(screen_question(question))
+        if verdict is not None:
+            record_prescreen("answered")
+            results[i] = verdict, 0, 0, None
+            continue
+        cached = lookup_evaluation(batch_cache_key(question))
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append(i)
+    return results, misses
+
+
+def apply_batch_results(questions: list[FormQuestion], results: dict, timeout: float):
+    for i, question in enumerate(questions):
+        if question.finalized:
+            continue
+        response, _, _, reason = results.get(
+            i, (None, 0, 0, f"Grading did not finish within {timeout}s")
+        )
+        apply_evaluation(question, response, reason)
+    return questions
+
+
+def check_all_answers_batched(
+    questions: list[FormQuestion], timeout: float = GRADING_BATCH_TIMEOUT
+) -> list[FormQuestion]:
+
+    deadline = time.monotonic() + timeout
+    results, misses = lookup_cached_answers(questions)
+
+    futures = {
+        submit_grading(evaluate_answer_batch, [questions[i] for i in batch]): batch
+        for batch in plan_answer_batches(questions, misses)
+    }
+    done, _ = wait(futures, timeout=timeout)
+
+    # Batches that failed validation are regraded per question in the time left
+    fallback = {}
+    for future, batch in futures.items():
+        if future not in done:
+            future.cancel()
+        elif future.exception() is None and future.result() is not None:
+            results.update(zip(batch, future.result()))
+        else:
+            for i in batch:
+                fallback[i] = submit_grading(_evaluate_isolated, questions[i])
+
+    if fallback:
+        done, _ = wait(fallback.values(), timeout=max(0.0, deadline - time.monotonic()))
+        for i, future in fallback.items():
+            if future in done:
+                results[i] = future.result()
+            else:
+                future.cancel()
+
+    return apply_batch_results(questions, results, timeout)
+
+
+def make_reduce_requests_messages(requests: list[InformationRequest]) -> list[dict]:
 
     system_prompt = (
         "Your job is to determine if the following information requests "
@@ -165,19 +691,17 @@ def reduce_requests(requests: list[InformationRequest]) -> InformationRequests:
     )
     user_message = make_message("user", user_prompt)
 
-    messages = [system_message, user_message]
+    return [system_message, user_message]
 
-    response: InformationRequests
-    response, _, _, reason = call_gpt_formatted(messages, InformationRequests)
 
-    if response is None:
-        print(f"Error from OpenAI:\n {reason}\n")
-        reduced_requests = []
+def reduce_requests(requests: list[InformationRequest]) -> list[InformationRequest]:
 
-    else:
-        reduced_requests = response.requests
+    messages = make_reduce_requests_messages(requests)
+
+    response: InformationRequests
+    response, _, _, reason = call_routed(messages, InformationRequests, "reduce_requests")
 
-    return reduced_requests
+    return unpack_requests(response, reason)
 
 
 def serve_requests_to_user_input(requests: list[InformationRequest]) -> list[str]:
@@ -189,20 +713,76 @@ def serve_requests_to_user_input(requests: list[InformationRequest]) -> list[str
     return answers
 
 
-def verify_answers(questions: list[FormQuestion]) -> list[FormQuestion]:
+def needs_more_info(question: FormQuestion) -> bool:
+    evaluation = question.answer_evaluation
+    return not question.finalized and evaluation is not None and evaluation.missing_info
 
-    # Check all answers
-    questions = check_all_answers(questions)
 
-    # Create information requests for all questions that are not finalized
-    # and are missing information
+def _create_info_requests_isolated(question: FormQuestion) -> list[InformationRequest]:
+    try:
+        return create_info_requests(question)
+    except Exception as e:
+        print(f"Error from OpenAI:\n {type(e).__name__}: {e}\n")
+        return []
+
+
+def collect_info_requests(
+    questions: list[FormQuestion], timeout: float = GRADING_BATCH_TIMEOUT
+) -> list[InformationRequest]:
+
+    deadline = time.monotonic() + timeout
+
+    # Start generating information requests for a question the moment its grade
+    # comes back missing info, while the rest of the form is still being graded
+    futures = {}
+    if GRADING_BATCH_MODE:
+        check_all_answers(questions, timeout)
+        graded = range(len(questions))
+    else:
+        graded = (i for i, _, _ in iter_checked_answers(questions, timeout))
+
+    for i in graded:
+        if needs_more_info(questions[i]):
+            futures[i] = submit_grading(_create_info_requests_isolated, questions[i])
+
+    done, not_done = wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+    for future in not_done:
+        future.cancel()
+
+    # Keep the requests in question order so the output is stable
     requests = []
-    for question in questions:
-        if not question.finalized and question.answer_evaluation.missing_info:
-            requests.extend(create_info_requests(question))
+    for i in sorted(futures):
+        if futures[i] in done:
+            requests.extend(futures[i].result())
+    return requests
+
+
+def normalize_request(question: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def dedupe_requests(requests: list[InformationRequest]) -> list[InformationRequest]:
+    seen = set()
+    unique = []
+    for r in requests:
+        key = normalize_request(r.question)
+        if key not in seen:
+            seen.add(key)
+            unique.append(r)
+    return unique
+
+
+def verify_answers(questions: list[FormQuestion]) -> list[FormQuestion]:
 
-    # Combine the requests with each other to reduce redundancy
-    reduced_requests = reduce_requests(requests)
+    # Check all answers and create information requests for all questions that
+    # are not finalized and are missing information
+    requests = collect_info_requests(questions)
+
+    # Drop exact and near-exact repeats locally, and only ask the model to
+    # combine requests when there is more than one left to combine
+    reduced_requests = dedupe_requests(requests)
+    if len(reduced_requests) > 1:
+        reduced_requests = reduce_requests(reduced_requests)
 
     new_information: dict = serve_requests_to_user_input(reduced_requests)
 
@@ -211,42 +791,341 @@ def verify_answers(questions: list[FormQuestion]) -> list[FormQuestion]:
         print(f"{key}: {value}")
 
 
-def check_answers_and_give_feedback(questions: list[FormQuestion]) -> list:
+def make_feedback(question: FormQuestion) -> dict:
+    d = {"question": question.question, "answer": question.answer}
+    if question.answer_evaluation is not None:
+        d["evaluation"] = question.answer_evaluation.to_dict()
+    else:
+        d["evaluation"] = None
+    if question.prescreen_flags:
+        d["prescreen"] = [flag.to_dict() for flag in question.prescreen_flags]
+    return d
+
+
+def draft_policy_tag(question: FormQuestion) -> str:
+    # What evaluate_answer would grade this answer with, so a change to the
+    # routing or pre-screen settings regrades it
+    _, verdict, model = screen_for_grading(question)
+    if verdict is not None:
+        return f"prescreen:{PRESCREEN_MODE}"
+    return grading_policy("check_answer", model).tag
+
+
+def draft_rules_hash(question: FormQuestion) -> str:
+    # Anything besides the answer that would change the grade
+    return make_cache_key(
+        question.question,
+        "",
+        resolve_rules_hash(question),
+        draft_policy_tag(question),
+        GRADING_TEMPERATURE,
+        ANSWER_REASON_SCHEMA,
+    )
+
+
+def draft_key(index: int, question: FormQuestion) -> str:
+    # Forms can ask the same question more than once
+    return f"{index}:{question.question}"
+
+
+def restore_draft(form_id: str, questions: list[FormQuestion]) -> list[int]:
+    # Applies the stored grade to every answer that is unchanged since the last
+    # submission of this form, and returns the indexes that still need grading
+    draft = get_draft_store().get(form_id)
+    changed = []
+    for i, question in enumerate(questions):
+        entry = draft.get(draft_key(i, question))
+        if (
+            entry is not None
+            and entry["answer"] == question.answer
+            and entry["rules_hash"] == draft_rules_hash(question)
+        ):
+            apply_evaluation(question, AnswerReason(**entry["evaluation"]), None)
+        else:
+            changed.append(i)
+    return changed
+
+
+def save_draft(form_id: str, questions: list[FormQuestion]) -> None:
+    # Failed grades are left out so the next submission retries them
+    draft = {
+        draft_key(i, question): {
+            "answer": question.answer,
+            "rules_hash": draft_rules_hash(question),
+            "evaluation": question.answer_evaluation.model_dump(),
+        }
+        for i, question in enumerate(questions)
+        if question.answer_evaluation is not None
+    }
+    get_draft_store().set(form_id, draft)
+
+
+def iter_checked_drafts(
+    questions: list[FormQuestion], form_id: str = None, timeout: float = GRADING_BATCH_TIMEOUT
+):
+    # iter_checked_answers, but answers unchanged since the form was last
+    # submitted come straight from the draft store
+    if not form_id:
+        yield from iter_checked_answers(questions, timeout)
+        return
+
+    changed = restore_draft(form_id, questions)
+    unchanged = set(range(len(questions))) - set(changed)
+    for i in sorted(unchanged):
+        yield i, 0, 0
+
+    try:
+        remaining = [questions[i] for i in changed]
+        for j, tokens_in, tokens_out in iter_checked_answers(remaining, timeout):
+            yield changed[j], tokens_in, tokens_out
+    finally:
+        save_draft(form_id, questions)
+
+
+def check_answers_and_give_feedback(questions: list[FormQuestion], form_id: str = None) -> list:
+    # Only answers that changed since the last submission of this form are graded
+    changed = restore_draft(form_id, questions) if form_id else range(len(questions))
+
     # Check all answers
-    questions = check_all_answers(questions)
+    check_all_answers([questions[i] for i in changed])
+    if form_id:
+        save_draft(form_id, questions)
 
     # Create a dict to store the feedback and show it to the original user
-    feedback = []
-    for question in questions:
-        d = {"question": question.question, "answer": question.answer}
-        d["evaluation"] = question.answer_evaluation.to_dict()
-        feedback.append(d)
-
-    return feedback
+    return [make_feedback(question) for question in questions]
 
 
-def check_full_cover_letter(letter: CoverLetter) -> dict:
-    # check cover letter
-    q: FormQuestion = FormQuestion(
+def make_cover_letter_question(letter: CoverLetter) -> FormQuestion:
+    return FormQuestion(
         question="Write a cover letter for an asylum application.",
-        specific_rules=make_cover_letter_rules(),
+        specific_rules=COVER_LETTER_RULES.texts,
         answer=letter.body,
         answer_evaluation=None,
         finalized=False,
     )
 
-    # check the answer
-    check_answer(q)
 
-    feedback = {}
-    feedback["question"] = q.question
-    feedback["answer"] = q.answer
-    feedback["evaluation"] = q.answer_evaluation.to_dict()
+@dataclass
+class LetterSection:
+    heading: str
+    start: int
+    end: int
+    text: str
+
+    def location(self, index: int) -> str:
+        if self.heading:
+            return f"Section {index + 1} ({self.heading})"
+        return f"Section {index + 1}"
+
+
+# Paragraphs are runs of text separated by blank lines
+PARAGRAPH_PATTERN = re.compile(r"\S(?:[^\n]|\n(?![ \t]*\n))*")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+(?:[.!?]+|$)\s*")
+HEADING_PATTERN = re.compile(r"#{1,6}\s+\S.*|(?:\d+|[IVXLC]+|[A-Z])[.)]\s+[^.!?]+|[^.!?]+:")
+
+COVER_LETTER_SECTION_QUESTION = (
+    "Write one section of a cover letter for an asylum application. Judge only "
+    "what this section says, and do not mark information as missing if it "
+    "belongs in another section of the letter."
+)
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > 80:
+        return False
+    return line.isupper() or HEADING_PATTERN.fullmatch(line) is not None
+
+
+def split_letter_blocks(body: str) -> list[tuple[int, int, bool]]:
+    # (start, end, is_heading) for each paragraph, with a heading on the first
+    # line of a paragraph split off into its own block
+    blocks = []
+    for match in PARAGRAPH_PATTERN.finditer(body):
+        start, end = match.span()
+        line_end = body.find("\n", start, end)
+        if line_end == -1 or not is_heading(body[start:line_end]):
+            blocks.append((start, end, is_heading(body[start:end]) and line_end == -1))
+            continue
+
+        blocks.append((start, line_end, True))
+        rest = re.compile(r"\S").search(body, line_end, end)
+        if rest:
+            blocks.append((rest.start(), end, False))
+    return blocks
+
+
+def split_oversized_block(body: str, start: int, end: int) -> list[tuple[int, int, bool, int]]:
+    spans = [m.span() for m in SENTENCE_PATTERN.finditer(body, start, end) if m.group().strip()]
+    counts = count_tokens_many([body[s:e] for s, e in spans], GRADING_MODEL)
+    return [(s, e, False, tokens) for (s, e), tokens in zip(spans, counts)]
+
+
+def split_letter_sections(
+    body: str, budget: int = COVER_LETTER_SECTION_TOKENS
+) -> list[LetterSection]:
+
+    blocks = split_letter_blocks(body)
+    counts = count_tokens_many([body[s:e] for s, e, _ in blocks], GRADING_MODEL)
+
+    # Paragraphs too long for one section are broken up at sentence boundaries
+    pieces = []
+    for (start, end, heading), tokens in zip(blocks, counts):
+        if heading or tokens <= budget:
+            pieces.append((start, end, heading, tokens))
+        else:
+            pieces.extend(split_oversized_block(body, start, end))
+
+    # Pack pieces into sections of up to `budget` tokens. A heading always
+    # starts a new section, and its text is carried over to the continuations.
+    sections = []
+    section_tokens, has_content = 0, False
+    for start, end, heading, tokens in pieces:
+        if heading:
+            sections.append(LetterSection(body[start:end].strip(), start, end, ""))
+            section_tokens, has_content = tokens, False
+            continue
+
+        if not sections or (has_content and section_tokens + tokens > budget):
+            carried = sections[-1].heading if sections else None
+            sections.append(LetterSection(carried, start, end, ""))
+            section_tokens = 0
+
+        sections[-1].end = end
+        section_tokens, has_content = section_tokens + tokens, True
+
+    for section in sections:
+        section.text = body[section.start : section.end]
+    return sections
+
+
+def make_letter_section_questions(
+    letter: CoverLetter, sections: list[LetterSection]
+) -> list[FormQuestion]:
+    # One question per section against the per-section rules, plus one for the
+    # rules that can only be judged on the whole letter
+    questions = [
+        FormQuestion(
+            question=COVER_LETTER_SECTION_QUESTION,
+            specific_rules=COVER_LETTER_SECTION_RULES.texts,
+            answer=section.text,
+            answer_evaluation=None,
+            finalized=False,
+        )
+        for section in sections
+    ]
+    questions.append(
+        FormQuestion(
+            question="Write a cover letter for an asylum application.",
+            specific_rules=COVER_LETTER_WIDE_RULES.texts,
+            answer=letter.body,
+            answer_evaluation=None,
+            finalized=False,
+        )
+    )
+    return questions
+
+
+def needs_changes(evaluation: AnswerReason) -> bool:
+    return (
+        evaluation.rule_violation
+        or evaluation.missing_info
+        or evaluation.said_too_much
+        or evaluation.irrelevant_info
+    )
+
 
+def merge_letter_evaluations(
+    sections: list[LetterSection], parts: list[FormQuestion]
+) -> AnswerReason:
+
+    locations = [section.location(i) for i, section in enumerate(sections)] + ["Whole letter"]
+    evaluations = [
+        (location, part.answer_evaluation)
+        for location, part in zip(locations, parts)
+        if part.answer_evaluation is not None
+    ]
+    if not evaluations:
+        return None
+
+    flagged = [(location, e) for location, e in evaluations if needs_changes(e)]
+    return AnswerReason(
+        rule_violation=any(e.rule_violation for _, e in evaluations),
+        missing_info=any(e.missing_info for _, e in evaluations),
+        said_too_much=any(e.said_too_much for _, e in evaluations),
+        irrelevant_info=any(e.irrelevant_info for _, e in evaluations),
+        reasoning="\n".join(f"{location}: {e.reasoning}" for location, e in flagged)
+        or "Every section of the letter follows the rules.",
+    )
+
+
+def make_sectioned_feedback(
+    letter: CoverLetter, sections: list[LetterSection], parts: list[FormQuestion]
+) -> dict:
+
+    q = make_cover_letter_question(letter)
+    apply_evaluation(q, merge_letter_evaluations(sections, parts), "No section could be graded")
+
+    feedback = make_feedback(q)
+    feedback["sections"] = [
+        {
+            "heading": section.heading,
+            "start": section.start,
+            "end": section.end,
+            "evaluation": make_feedback(part)["evaluation"],
+        }
+        for section, part in zip(sections, parts)
+    ]
+    feedback["letter_wide"] = make_feedback(parts[-1])["evaluation"]
     return feedback
 
 
+def is_long_letter(letter: CoverLetter) -> bool:
+    return not fits_token_budget(letter.body, COVER_LETTER_SECTION_THRESHOLD, GRADING_MODEL)
+
+
+def check_cover_letter_sections(
+    letter: CoverLetter, timeout: float = GRADING_BATCH_TIMEOUT
+) -> dict:
+
+    sections = split_letter_sections(letter.body)
+    parts = make_letter_section_questions(letter, sections)
+
+    futures = [submit_grading(_evaluate_isolated, part, "cover_letter_section") for part in parts]
+    done, _ = wait(futures, timeout=timeout)
+
+    for part, future in zip(parts, futures):
+        if future in done:
+            response, _, _, reason = future.result()
+        else:
+            future.cancel()
+            response, reason = None, f"Grading did not finish within {timeout}s"
+        apply_evaluation(part, response, reason)
+
+    return make_sectioned_feedback(letter, sections, parts)
+
+
+def check_full_cover_letter(letter: CoverLetter) -> dict:
+    # long letters are graded section by section
+    if is_long_letter(letter):
+        return check_cover_letter_sections(letter)
+
+    # check cover letter
+    q = make_cover_letter_question(letter)
+
+    # check the answer
+    check_answer(q, endpoint="cover_letter")
+
+    return make_feedback(q)
+
+
 def main():
+    # bulk mode re-grades a whole JSONL corpus of forms through the Batch API
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        from bulk_grade import main as bulk_main
+
+        return bulk_main(sys.argv[2:])
+
     # read in questions from a file
     questions = {}
     with open(sys.argv[1], "r") as f:
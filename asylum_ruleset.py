@@ -1,52 +1,207 @@
-def make_rules_short_answer():
+from dataclasses import dataclass
+import hashlib
 
-    rules = [
-        "Do tie issues back to the government. ",
-        "Asylum under the Refugee Convention requires demonstrating a well-founded fear of persecution based on a protected class (race, religion, politics, etc.) by the government or actors the government cannot control.",
-        "File asylum applications within one year of entering the U.S. and ensure the applicant has not been previously deported.",
-        "Withholding of Removal under the Convention Against Torture requires proof of likely torture if returned to the home country, without time limits or protected class requirements, but does not offer a path to citizenship.",
-        "Answers can be brief summaries tied back to the cover letter.",
-        "Include exhibits such as personal evidence (affidavits, medical records, membership proofs), journalistic coverage, and human rights reports to substantiate the claim.",
-        "Avoid economic hardship arguments unless tied to government persecution targeting jobs, property, or livelihood.",
-        "Specify perpetrators of persecution; do not use vague terms like 'they' without clear antecedents.",
-        "Demonstrate government involvement or inability to protect; private violence alone is insufficient.",
-        "Establish a protected ground for persecution: race, religion, nationality, political opinion, or membership in a particular social group (PSG).",
-        "Provide credible, specific, and consistent testimony and documentation to establish a well-founded fear of persecution.",
-        "Tie instances of harm or threats directly to the protected ground, showing it is 'one central reason' for the persecution.",
-        "Demonstrate government involvement through direct actions (e.g., police abuse) or inability/unwillingness to protect (e.g., failed police reports).",
-        "Corroborate claims with evidence such as medical reports, affidavits, expert witness statements, and credible media or NGO reports.",
-        "Address potential bars to asylum (e.g., firm resettlement, criminal convictions) directly and proactively.",
-        "Focus on showing that persecution is due to a protected ground, is above general hardship, and involves government action or inaction.",
-        "Maintain consistency and address any discrepancies in the story with reasonable explanations.",
-    ]
+# Bump when the grading instructions around the rules change; a change to the
+# rule text itself already changes every hash below
+RULESET_VERSION = "2025-01-1"
 
-    result = "\n ".join(rules)
-    return result
 
-def make_cover_letter_rules():
+@dataclass(frozen=True)
+class Rule:
+    id: str
+    text: str
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
 
 
-    rules = [
+def hash_rules(rules) -> str:
+    # Cached grades are keyed on this instead of the rules text
+    hashes = "\n".join(rule.hash for rule in rules)
+    return hashlib.sha256(f"{RULESET_VERSION}\n{hashes}".encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    name: str
+    rules: tuple[Rule, ...]
+    rendered: str
+    hash: str
+
+    @property
+    def texts(self) -> list[str]:
+        return [rule.text for rule in self.rules]
+
+
+RULES = {
+    "no-economic-uncertainty": Rule(
+        "no-economic-uncertainty",
         "Don't mention economic uncertainty or job opportunities in the home country. ",
+    ),
+    "government-tie": Rule(
+        "government-tie",
         "Do tie issues back to the government. ",
+    ),
+    "all-three-protections": Rule(
+        "all-three-protections",
         "Always apply for all three types of protection (Asylum, Withholding of Removal under the Refugee Convention, Withholding of Removal under the Convention Against Torture) using the same I-589 form.",
+    ),
+    "refugee-convention": Rule(
+        "refugee-convention",
         "Asylum under the Refugee Convention requires demonstrating a well-founded fear of persecution based on a protected class (race, religion, politics, etc.) by the government or actors the government cannot control.",
+    ),
+    "one-year-filing": Rule(
+        "one-year-filing",
         "File asylum applications within one year of entering the U.S. and ensure the applicant has not been previously deported.",
+    ),
+    "cat-withholding": Rule(
+        "cat-withholding",
         "Withholding of Removal under the Convention Against Torture requires proof of likely torture if returned to the home country, without time limits or protected class requirements, but does not offer a path to citizenship.",
+    ),
+    "detailed-cover-letter": Rule(
+        "detailed-cover-letter",
         "Use a detailed cover letter to tell the applicant's story comprehensively and link events to evidence/exhibits.",
+    ),
+    "exhibits": Rule(
+        "exhibits",
         "Include exhibits such as personal evidence (affidavits, medical records, membership proofs), journalistic coverage, and human rights reports to substantiate the claim.",
+    ),
+    "economic-hardship": Rule(
+        "economic-hardship",
         "Avoid economic hardship arguments unless tied to government persecution targeting jobs, property, or livelihood.",
+    ),
+    "specify-perpetrators": Rule(
+        "specify-perpetrators",
         "Specify perpetrators of persecution; do not use vague terms like 'they' without clear antecedents.",
+    ),
+    "government-protection": Rule(
+        "government-protection",
         "Demonstrate government involvement or inability to protect; private violence alone is insufficient.",
+    ),
+    "protected-ground": Rule(
+        "protected-ground",
         "Establish a protected ground for persecution: race, religion, nationality, political opinion, or membership in a particular social group (PSG).",
+    ),
+    "credible-testimony": Rule(
+        "credible-testimony",
         "Provide credible, specific, and consistent testimony and documentation to establish a well-founded fear of persecution.",
+    ),
+    "central-reason": Rule(
+        "central-reason",
         "Tie instances of harm or threats directly to the protected ground, showing it is 'one central reason' for the persecution.",
+    ),
+    "government-involvement": Rule(
+        "government-involvement",
         "Demonstrate government involvement through direct actions (e.g., police abuse) or inability/unwillingness to protect (e.g., failed police reports).",
+    ),
+    "corroboration": Rule(
+        "corroboration",
         "Corroborate claims with evidence such as medical reports, affidavits, expert witness statements, and credible media or NGO reports.",
+    ),
+    "bars-to-asylum": Rule(
+        "bars-to-asylum",
         "Address potential bars to asylum (e.g., firm resettlement, criminal convictions) directly and proactively.",
+    ),
+    "above-general-hardship": Rule(
+        "above-general-hardship",
         "Focus on showing that persecution is due to a protected ground, is above general hardship, and involves government action or inaction.",
+    ),
+    "consistency": Rule(
+        "consistency",
         "Maintain consistency and address any discrepancies in the story with reasonable explanations.",
-    ]
+    ),
+    "brief-summaries": Rule(
+        "brief-summaries",
+        "Answers can be brief summaries tied back to the cover letter.",
+    ),
+}
+
+
+def make_rule_set(name: str, rule_ids: list[str]) -> RuleSet:
+    rules = tuple(RULES[rule_id] for rule_id in rule_ids)
+    rendered = "\n ".join(rule.text for rule in rules)
+    return RuleSet(name, rules, rendered, hash_rules(rules))
+
+
+SHORT_ANSWER_RULES = make_rule_set(
+    "short_answer",
+    [
+        "government-tie",
+        "refugee-convention",
+        "one-year-filing",
+        "cat-withholding",
+        "brief-summaries",
+        "exhibits",
+        "economic-hardship",
+        "specify-perpetrators",
+        "government-protection",
+        "protected-ground",
+        "credible-testimony",
+        "central-reason",
+        "government-involvement",
+        "corroboration",
+        "bars-to-asylum",
+        "above-general-hardship",
+        "consistency",
+    ],
+)
 
-    result = "\n ".join(rules)
-    return result
\ No newline at end of file
+COVER_LETTER_RULES = make_rule_set(
+    "cover_letter",
+    [
+        "no-economic-uncertainty",
+        "government-tie",
+        "all-three-protections",
+        "refugee-convention",
+        "one-year-filing",
+        "cat-withholding",
+        "detailed-cover-letter",
+        "exhibits",
+        "economic-hardship",
+        "specify-perpetrators",
+        "government-protection",
+        "protected-ground",
+        "credible-testimony",
+        "central-reason",
+        "government-involvement",
+        "corroboration",
+        "bars-to-asylum",
+        "above-general-hardship",
+        "consistency",
+    ],
+)
+
+# Long cover letters are graded section by section. These rules are judged
+# against the whole letter once; every other cover-letter rule is judged per section.
+LETTER_WIDE_RULE_IDS = (
+    "all-three-protections",
+    "one-year-filing",
+    "detailed-cover-letter",
+    "consistency",
+)
+
+COVER_LETTER_SECTION_RULES = make_rule_set(
+    "cover_letter_section",
+    [rule.id for rule in COVER_LETTER_RULES.rules if rule.id not in LETTER_WIDE_RULE_IDS],
+)
+
+COVER_LETTER_WIDE_RULES = make_rule_set("cover_letter_wide", list(LETTER_WIDE_RULE_IDS))
+
+RULE_SETS = {
+    rule_set.name: rule_set
+    for rule_set in (
+        SHORT_ANSWER_RULES,
+        COVER_LETTER_RULES,
+        COVER_LETTER_SECTION_RULES,
+        COVER_LETTER_WIDE_RULES,
+    )
+}
+
+
+def make_rules_short_answer():
+    return SHORT_ANSWER_RULES.rendered
+
+
+def make_cover_letter_rules():
+    return COVER_LETTER_RULES.rendered
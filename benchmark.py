@@ -0,0 +1,228 @@
+from llm_backends import CassetteBackend, FakeBackend
+from llm_scheduler import RateLimitScheduler, set_scheduler
+from openai_utils import set_llm_backend
+from rule_index import set_rule_selection_top_k
+from token_utils import count_tokens
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse, contextlib, json, os, random, resource, statistics, sys, time, tracemalloc
+
+# Drives the Flask routes in-process against a fake or replayed model, so the
+# numbers measure our own overhead and concurrency behaviour, not OpenAI's.
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_synthetic_forms(
+    examples: list[dict], count: int, questions_per_form: int, seed: int, unique: bool
+) -> list[dict]:
+    rng = random.Random(seed)
+    forms = []
+    for form in range(count):
+        questions = []
+        for i in range(questions_per_form):
+            example = rng.choice(examples)
+            answer = example["answer"]
+            if unique:
+                # Distinct answers keep the grading cache from hiding model latency
+                answer = f"{answer} (form {form}, answer {i})"
+            questions.append(
+                {
+                    "question": example["question"],
+                    "specific_rules": example["specific_rules"],
+                    "answer": answer,
+                }
+            )
+        forms.append({"questions": questions})
+    return forms
+
+
+def make_cover_letters(forms: list[dict]) -> list[dict]:
+    return [{"body": "\n\n".join(q["answer"] for q in form["questions"])} for form in forms]
+
+
+def simulated_client_ip(index: int) -> str:
+    return f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+
+
+def run_level(app, route: str, payloads: list[dict], concurrency: int) -> dict:
+    # Every request comes from its own simulated client, so the per-client
+    # admission budget does not turn the run into one client's queue
+    def send(index, payload):
+        client = app.test_client()
+        headers = {"Fly-Client-IP": simulated_client_ip(index)}
+        start = time.perf_counter()
+        response = client.post(route, json=payload, headers=headers)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(len(payloads)), payloads))
+    elapsed = time.perf_counter() - start
+
+    # Admission rejections come back at once, so they are counted on their own
+    # and kept out of the latency figures
+    latencies = [latency for latency, status in results if status != 429] or [0.0]
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "rejected": sum(status == 429 for _, status in results),
+        "errors": sum(status not in (200, 429) for _, status in results),
+        "throughput": len(results) / elapsed,
+        "mean": statistics.fmean(latencies),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "peak_traced_mb": tracemalloc.get_traced_memory()[1] / 2**20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_report(rows: list[dict]) -> None:
+    header = (
+        f"{'route':<16}{'conc':>6}{'reqs':>6}{'429s':>6}{'errs':>6}{'req/s':>9}"
+        f"{'p50':>8}{'p95':>8}{'p99':>8}{'heap MB':>9}{'rss MB':>9}"
+    )
+    print(header)
+    for row in rows:
+        print(
+            f"{row['route']:<16}{row['concurrency']:>6}{row['requests']:>6}{row['rejected']:>6}"
+            f"{row['errors']:>6}"
+            f"{row['throughput']:>9.2f}{row['p50']:>8.3f}{row['p95']:>8.3f}{row['p99']:>8.3f}"
+            f"{row['peak_traced_mb']:>9.1f}{row['max_rss_mb']:>9.1f}"
+        )
+
+
+def grade_with_rules(questions: list[dict], top_k: int):
+    from asylum_check import check_all_answers, make_check_answer_messages, make_question_from_json
+    from metrics import start_request_usage
+
+    set_rule_selection_top_k(top_k)
+    graded = [make_question_from_json(q) for q in questions]
+    usage = start_request_usage("consistency")
+    check_all_answers(graded)
+    prompt_tokens = [count_tokens(make_check_answer_messages(q)[0]["content"]) for q in graded]
+    return graded, usage.tokens_in, statistics.fmean(prompt_tokens)
+
+
+def run_consistency(questions: list[dict], top_k: int) -> dict:
+    # Grades the same answers with every rule and with the selected rules, and
+    # reports how often the verdicts match and how much prompt was saved
+    from asylum_check import answer_flags
+
+    full, full_tokens, full_prompt = grade_with_rules(questions, 0)
+    selected, selected_tokens, selected_prompt = grade_with_rules(questions, top_k)
+    pairs = [
+        (a, b)
+        for a, b in zip(full, selected)
+        if a.answer_evaluation is not None and b.answer_evaluation is not None
+    ]
+    return {
+        "top_k": top_k,
+        "questions": len(questions),
+        "compared": len(pairs),
+        "verdict_agreement": (
+            statistics.fmean(a.finalized == b.finalized for a, b in pairs) if pairs else 0.0
+        ),
+        "flag_agreement": (
+            statistics.fmean(
+                answer_flags(a.answer_evaluation) == answer_flags(b.answer_evaluation)
+                for a, b in pairs
+            )
+            if pairs
+            else 0.0
+        ),
+        "system_prompt_tokens_full": full_prompt,
+        "system_prompt_tokens_selected": selected_prompt,
+        "tokens_in_full": full_tokens,
+        "tokens_in_selected": selected_tokens,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency benchmark for the grading routes")
+    parser.add_argument("--examples", default="example_questions.json")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Comma separated levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per level")
+    parser.add_argument("--questions", type=int, default=10, help="Questions per form")
+    parser.add_argument("--routes", default="/gradequestions,/coverletter")
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, help="Scheduler requests/min, off by default")
+    parser.add_argument("--tpm", type=float, help="Scheduler tokens/min, off by default")
+    parser.add_argument("--cassettes", help="Replay recorded responses from this directory")
+    parser.add_argument("--allow-cache", action="store_true", help="Reuse identical answers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument(
+        "--consistency",
+        type=int,
+        metavar="TOP_K",
+        help="Compare verdicts with all rules against RULE_SELECTION_TOP_K=TOP_K instead",
+    )
+    parser.add_argument(
+        "--live", action="store_true", help="Grade with the LLM_BACKEND from the environment"
+    )
+    args = parser.parse_args(argv)
+
+    if args.cassettes:
+        set_llm_backend(CassetteBackend(args.cassettes, "replay"))
+    elif not args.live:
+        set_llm_backend(
+            FakeBackend(
+                latency_median=args.latency_median,
+                latency_sigma=args.latency_sigma,
+                rate_limit_rate=args.rate_limit_rate,
+                retry_after=0.2,
+                seed=args.seed,
+            )
+        )
+
+    # Rate limits are off by default so the run measures our own overhead;
+    # pass the production limits to see where they start to bite
+    set_scheduler(RateLimitScheduler(requests_per_minute=args.rpm, tokens_per_minute=args.tpm))
+
+    # Imported after the backend is set so nothing can reach the real API
+    from app import app
+
+    with open(args.examples, "r") as f:
+        examples = json.load(f)
+
+    if args.consistency is not None:
+        forms = make_synthetic_forms(examples, args.requests, args.questions, args.seed, True)
+        questions = [q for form in forms for q in form["questions"]]
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = run_consistency(questions, args.consistency)
+        print(json.dumps(report, indent=2))
+        return
+
+    tracemalloc.start()
+    rows = []
+    for level in (int(c) for c in args.concurrency.split(",")):
+        forms = make_synthetic_forms(
+            examples, args.requests, args.questions, args.seed + level, not args.allow_cache
+        )
+        for route in args.routes.split(","):
+            payloads = make_cover_letters(forms) if route == "/coverletter" else forms
+            # The routes log every payload, which would drown out the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                rows.append(run_level(app, route, payloads, level))
+            tracemalloc.reset_peak()
+
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+from asylum_check import (
+    AnswerReason,
+    FormQuestion,
+    GRADING_MODEL,
+    GRADING_TEMPERATURE,
+    apply_evaluation,
+    make_check_answer_messages,
+    make_feedback,
+    make_question_from_json,
+)
+from openai_utils import call_gpt_formatted, get_openai_client, response_format_param
+from typing import Iterator
+
+import argparse, itertools, json, os, shutil, threading, time, uuid
+
+BATCH_ENDPOINT_URL = "/v1/chat/completions"
+BATCH_MAX_TOKENS = 4069
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+# Corpus lines look like {"form_id": "...", "questions": [{question, specific_rules, answer}]}
+def iter_forms(corpus_path: str) -> Iterator[dict]:
+    with open(corpus_path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_chunks(forms: Iterator[dict], chunk_size: int) -> Iterator[list[dict]]:
+    while True:
+        chunk = list(itertools.islice(forms, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def make_custom_id(form_id: str, question_index: int) -> str:
+    return f"{form_id}/{question_index}"
+
+
+def make_batch_request(custom_id: str, question: FormQuestion) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT_URL,
+        "body": {
+            "model": GRADING_MODEL,
+            "messages": make_check_answer_messages(question),
+            "temperature": GRADING_TEMPERATURE,
+            "max_tokens": BATCH_MAX_TOKENS,
+            "response_format": response_format_param(AnswerReason),
+        },
+    }
+
+
+def parse_batch_result(result: dict):
+    # Returns (AnswerReason or None, reason) for one line of a batch output file
+    if result.get("error"):
+        return None, json.dumps(result["error"])
+
+    response = result["response"]
+    if response["status_code"] != 200:
+        return None, f"HTTP {response['status_code']}: {json.dumps(response['body'])}"
+
+    message = response["body"]["choices"][0]["message"]
+    if message.get("refusal"):
+        return None, "Refusal"
+
+    try:
+        return AnswerReason.model_validate_json(message["content"]), None
+    except ValueError as e:
+        return None, f"Invalid response: {e}"
+
+
+def grade_synchronously(question: FormQuestion, batch_reason: str):
+    # A line the batch could not grade is sent once more on the regular API,
+    # with the same model and prompt as the batch request
+    try:
+        response, _, _, reason = call_gpt_formatted(
+            make_check_answer_messages(question),
+            AnswerReason,
+            model=GRADING_MODEL,
+            temp=GRADING_TEMPERATURE,
+            max_tokens=BATCH_MAX_TOKENS,
+            endpoint="bulk_grade",
+        )
+    except Exception as e:
+        return None, f"{batch_reason}; then {type(e).__name__}: {e}"
+    if not response:
+        return None, f"{batch_reason}; then {reason}"
+    return response, None
+
+
+def is_answered(result: dict) -> bool:
+    # Lines worth keeping from a batch that did not complete; anything else,
+    # e.g. the "batch_expired" errors of an expired batch, is sent again
+    response = result.get("response")
+    return not result.get("error") and response is not None and response["status_code"] == 200
+
+
+def write_atomic(path: str, lines: Iterator[str]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class OpenAIBatchEndpoint:
+    def __init__(self, client=None):
+        self.client = client or get_openai_client()
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT_URL,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class LocalBatchEndpoint:
+    # Stand-in for the Batch API that honours the same file formats, so bulk runs
+    # can be exercised end to end without uploading anything. `handler` turns a
+    # request body into a chat completion body; by default the request is sent
+    # to the regular chat completions API one line at a time.
+    def __init__(self, work_dir: str, handler=None):
+        self.work_dir = work_dir
+        self.handler = handler or self._complete
+        self._status = {}
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _complete(self, body: dict) -> dict:
+        return get_openai_client().chat.completions.create(**body).model_dump()
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self.work_dir, f"{batch_id}.output.jsonl")
+
+    def _run(self, batch_id: str, requests_path: str) -> None:
+        def results():
+            with open(requests_path, "r") as f:
+                for line in f:
+                    request = json.loads(line)
+                    try:
+                        body = self.handler(request["body"])
+                        result = {"response": {"status_code": 200, "body": body}, "error": None}
+                    except Exception as e:
+                        result = {"response": None, "error": {"message": str(e)}}
+                    result["custom_id"] = request["custom_id"]
+                    yield json.dumps(result)
+
+        try:
+            write_atomic(self._output_path(batch_id), results())
+            self._status[batch_id] = "completed"
+        except Exception:
+            self._status[batch_id] = "failed"
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        self._status[batch_id] = "in_progress"
+        threading.Thread(target=self._run, args=(batch_id, requests_path), daemon=True).start()
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        if batch_id not in self._status:
+            # A batch submitted before a restart has either finished or was lost
+            return "completed" if os.path.exists(self._output_path(batch_id)) else "failed"
+        return self._status[batch_id]
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        if not os.path.exists(self._output_path(batch_id)):
+            return
+        with open(self._output_path(batch_id), "r") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class BulkGrader:
+    def __init__(
+        self,
+        endpoint,
+        out_dir: str,
+        chunk_size: int = 500,
+        max_in_flight: int = 4,
+        poll_interval: float = 60.0,
+        max_resubmits: int = 3,
+        sync_fallback: bool = True,
+    ):
+        self.endpoint = endpoint
+        self.out_dir = out_dir
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_resubmits = max_resubmits
+        self.sync_fallback = sync_fallback
+        self.checkpoint_path = os.path.join(out_dir, "checkpoint.json")
+        os.makedirs(out_dir, exist_ok=True)
+        self.checkpoint = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> dict:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("chunk_size") != self.chunk_size:
+                raise ValueError(
+                    f"Checkpoint was written with chunk size {checkpoint.get('chunk_size')}, "
+                    f"not {self.chunk_size}"
+                )
+            return checkpoint
+        return {"chunk_size": self.chunk_size, "chunks": {}}
+
+    def _save_checkpoint(self) -> None:
+        write_atomic(self.checkpoint_path, [json.dumps(self.checkpoint, indent=2)])
+
+    def _path(self, chunk: int, kind: str) -> str:
+        return os.path.join(self.out_dir, f"chunk-{chunk:05d}.{kind}.jsonl")
+
+    def submit_chunk(self, chunk: int, forms: list[dict]) -> None:
+        write_atomic(self._path(chunk, "forms"), (json.dumps(form) for form in forms))
+
+        def requests():
+            for form in forms:
+                for i, q in enumerate(form["questions"]):
+                    custom_id = make_custom_id(form["form_id"], i)
+                    yield json.dumps(make_batch_request(custom_id, make_question_from_json(q)))
+
+        write_atomic(self._path(chunk, "requests"), requests())
+        batch_id = self.endpoint.submit(self._path(chunk, "requests"))
+
+        self.checkpoint["chunks"][str(chunk)] = {"batch_id": batch_id, "status": "submitted"}
+        self._save_checkpoint()
+        print(f"Submitted chunk {chunk} ({len(forms)} forms) as {batch_id}")
+
+    def wait_for_batch(self, batch_id: str) -> str:
+        status = self.endpoint.poll(batch_id)
+        while status not in BATCH_FINAL_STATUSES:
+            time.sleep(self.poll_interval)
+            status = self.endpoint.poll(batch_id)
+        return status
+
+    def load_results(self, chunk: int) -> dict:
+        # Results kept from earlier batches of this chunk that did not complete
+        path = self._path(chunk, "results")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return {result["custom_id"]: result for result in map(json.loads, f)}
+
+    def resubmit_missing(self, chunk: int, state: dict, results: dict, status: str) -> bool:
+        # Keeps what the dead batch did finish and sends the rest as a new
+        # batch. Returns False when there is nothing more to wait for.
+        kept = {custom_id: result for custom_id, result in results.items() if is_answered(result)}
+        write_atomic(self._path(chunk, "results"), (json.dumps(r) for r in kept.values()))
+
+        with open(self._path(chunk, "requests"), "r") as f:
+            missing = [line.rstrip("\n") for line in f if json.loads(line)["custom_id"] not in kept]
+        if not missing:
+            return False
+
+        resubmits = state.get("resubmits", 0) + 1
+        if resubmits > self.max_resubmits:
+            # Give up on them; they are written out ungraded like any failed line
+            print(
+                f"Batch {state['batch_id']} for chunk {chunk} ended as {status}, "
+                f"giving up on {len(missing)} requests after {self.max_resubmits} resubmits"
+            )
+            return False
+
+        requests_path = self._path(chunk, f"requests-{resubmits}")
+        write_atomic(requests_path, missing)
+        batch_id = self.endpoint.submit(requests_path)
+        print(
+            f"Batch {state['batch_id']} for chunk {chunk} ended as {status}, "
+            f"resubmitted {len(missing)} requests as {batch_id}"
+        )
+
+        state.update(batch_id=batch_id, status="submitted", resubmits=resubmits)
+        self._save_checkpoint()
+        return True
+
+    def collect_chunk(self, chunk: int) -> None:
+        state = self.checkpoint["chunks"][str(chunk)]
+
+        while True:
+            status = self.wait_for_batch(state["batch_id"])
+            results = self.load_results(chunk)
+            results.update(
+                (result["custom_id"], result) for result in self.endpoint.results(state["batch_id"])
+            )
+            if status == "completed" or not self.resubmit_missing(chunk, state, results, status):
+                break
+
+        results = {custom_id: parse_batch_result(result) for custom_id, result in results.items()}
+
+        # Lines that failed inside the batch, e.g. a 500 or an invalid
+        # response, are graded one by one, and whatever still fails is listed
+        # under "errors" by question index
+        def graded():
+            for form in iter_forms(self._path(chunk, "forms")):
+                feedback, errors = [], {}
+                for i, q in enumerate(form["questions"]):
+                    question = make_question_from_json(q)
+                    response, reason = results.get(
+                        make_custom_id(form["form_id"], i), (None, "Missing from batch output")
+                    )
+                    if response is None and self.sync_fallback:
+                        response, reason = grade_synchronously(question, reason)
+                    if response is None:
+                        errors[str(i)] = reason
+                    apply_evaluation(question, response, reason)
+                    feedback.append(make_feedback(question))
+                yield json.dumps(
+                    {"form_id": form["form_id"], "feedback": feedback, "errors": errors}
+                )
+
+        write_atomic(self._path(chunk, "graded"), graded())
+
+        state["status"] = "done"
+        self._save_checkpoint()
+        print(f"Collected chunk {chunk}")
+
+    def run(self, corpus_path: str) -> None:
+        in_flight = []
+        for chunk, forms in enumerate(iter_chunks(iter_forms(corpus_path), self.chunk_size)):
+            state = self.checkpoint["chunks"].get(str(chunk))
+            if state is not None and state["status"] == "done":
+                continue
+            if state is None:
+                self.submit_chunk(chunk, forms)
+
+            in_flight.append(chunk)
+            if len(in_flight) >= self.max_in_flight:
+                self.collect_chunk(in_flight.pop(0))
+
+        for chunk in in_flight:
+            self.collect_chunk(chunk)
+
+    def merge(self, output_path: str) -> None:
+        chunks = sorted(int(chunk) for chunk in self.checkpoint["chunks"])
+        with open(output_path, "w") as out:
+            for chunk in chunks:
+                with open(self._path(chunk, "graded"), "r") as f:
+                    shutil.copyfileobj(f, out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-grade a JSONL corpus of forms in bulk")
+    parser.add_argument("corpus", help="JSONL file with one form per line")
+    parser.add_argument("out_dir", help="Directory for batch files, checkpoints and output")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Forms per batch")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Batches awaiting results")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between polls")
+    parser.add_argument(
+        "--max-resubmits", type=int, default=3, help="New batches per chunk for unfinished requests"
+    )
+    parser.add_argument(
+        "--no-sync-fallback",
+        action="store_true",
+        help="Report lines the batch failed instead of grading them on the regular API",
+    )
+    parser.add_argument("--local", action="store_true", help="Use the local batch stand-in")
+    parser.add_argument("--output", help="Merge graded chunks into this JSONL file at the end")
+    args = parser.parse_args(argv)
+
+    if args.local:
+        endpoint = LocalBatchEndpoint(os.path.join(args.out_dir, "local_batches"))
+    else:
+        endpoint = OpenAIBatchEndpoint()
+
+    grader = BulkGrader(
+        endpoint,
+        args.out_dir,
+        chunk_size=args.chunk_size,
+        max_in_flight=args.max_in_flight,
+        poll_interval=args.poll_interval,
+        max_resubmits=args.max_resubmits,
+        sync_fallback=not args.no_sync_fallback,
+    )
+    grader.run(args.corpus)
+
+    if args.output:
+        grader.merge(args.output)
+
+
+if __name__ == "__main__":
+    main()
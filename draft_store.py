@@ -0,0 +1,48 @@
+from grading_cache import MemoryCache, SQLiteCache
+import os, threading
+
+# Remembers the last graded version of every answer in a form, keyed by the
+# form_id the client sends, so a resubmission only regrades what changed
+DRAFT_STORE_SIZE = int(os.getenv("DRAFT_STORE_SIZE", "1024"))
+DRAFT_STORE_TTL = float(os.getenv("DRAFT_STORE_TTL", str(7 * 24 * 60 * 60)))
+# Drafts live in memory per worker unless this points at a shared sqlite file
+DRAFT_STORE_PATH = os.getenv("DRAFT_STORE_PATH")
+
+
+class DraftStore:
+    # A draft maps "<index>:<question text>" to {"answer", "rules_hash", "evaluation"}
+    def __init__(self, max_size=DRAFT_STORE_SIZE, ttl=DRAFT_STORE_TTL, path=DRAFT_STORE_PATH):
+        self.enabled = max_size > 0
+        self.memory = MemoryCache(max_size, ttl)
+        self.disk = SQLiteCache(path, ttl, table="drafts") if path and self.enabled else None
+
+    def get(self, form_id: str) -> dict:
+        if not self.enabled or not form_id:
+            return {}
+
+        draft = self.memory.get(form_id)
+        if draft is None and self.disk is not None:
+            draft = self.disk.get(form_id)
+            if draft is not None:
+                self.memory.set(form_id, draft)
+        return draft or {}
+
+    def set(self, form_id: str, draft: dict):
+        if not self.enabled or not form_id:
+            return
+        self.memory.set(form_id, draft)
+        if self.disk is not None:
+            self.disk.set(form_id, draft)
+
+
+_draft_store = None
+_draft_store_lock = threading.Lock()
+
+
+def get_draft_store() -> DraftStore:
+    global _draft_store
+    if _draft_store is None:
+        with _draft_store_lock:
+            if _draft_store is None:
+                _draft_store = DraftStore()
+    return _draft_store
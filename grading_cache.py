@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import hashlib, json, os, sqlite3, threading, time
+
+GRADING_CACHE_SIZE = int(os.getenv("GRADING_CACHE_SIZE", "2048"))
+GRADING_CACHE_TTL = float(os.getenv("GRADING_CACHE_TTL", str(24 * 60 * 60)))
+# Point this at a file on a shared volume to let every gunicorn worker reuse grades
+GRADING_CACHE_PATH = os.getenv("GRADING_CACHE_PATH")
+
+
+def make_cache_key(
+    question: str, answer: str, rules: str, model: str, temperature: float, schema: str
+) -> str:
+    payload = json.dumps([question, answer, rules, model, temperature, schema], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    def __init__(self, path: str, ttl: float, table: str = "grading_cache"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self._local = threading.local()
+        self._connect().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections cannot cross threads (or forks), so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        cursor = self._connect().execute(
+            f"SELECT value FROM {self.table} WHERE key = ? AND expires > ?", (key, time.time())
+        )
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl),
+        )
+        conn.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+
+
+class GradingCache:
+    def __init__(self, max_size=GRADING_CACHE_SIZE, ttl=GRADING_CACHE_TTL, path=GRADING_CACHE_PATH):
+        self.enabled = max_size > 0
+        self.memory = MemoryCache(max_size, ttl)
+        self.disk = SQLiteCache(path, ttl) if path and self.enabled else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict):
+        if not self.enabled:
+            return
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+
+_grading_cache = None
+_grading_cache_lock = threading.Lock()
+
+
+def get_grading_cache() -> GradingCache:
+    global _grading_cache
+    if _grading_cache is None:
+        with _grading_cache_lock:
+            if _grading_cache is None:
+                _grading_cache = GradingCache()
+    return _grading_cache
@@ -0,0 +1,96 @@
+import os
+
+# Sized for the fly.io VM in fly.toml (1 shared CPU, 512MB). Each worker is a
+# full copy of the app, so memory rather than CPU usually decides the count:
+# the app is preloaded so workers share its imports copy-on-write, and a worker
+# that grows past GUNICORN_WORKER_MAX_RSS_MB is recycled after its request.
+GUNICORN_BASE_MB = int(os.getenv("GUNICORN_BASE_MB", "120"))
+GUNICORN_WORKER_MB = int(os.getenv("GUNICORN_WORKER_MB", "150"))
+GUNICORN_WORKER_MAX_RSS_MB = int(os.getenv("GUNICORN_WORKER_MAX_RSS_MB", "300"))
+
+
+def get_cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_memory_mb() -> int:
+    # The cgroup limit when running in a container, otherwise the machine's memory
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            return int(limit) // 2**20
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            return int(next(line for line in f if line.startswith("MemTotal")).split()[1]) // 1024
+    except (OSError, StopIteration, ValueError):
+        return 512
+
+
+def get_worker_count() -> int:
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    by_cpu = 2 * get_cpu_count() + 1
+    by_memory = (get_memory_mb() - GUNICORN_BASE_MB) // GUNICORN_WORKER_MB
+    return max(1, min(by_cpu, by_memory))
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# Requests spend nearly all their time waiting on the model, so threads carry
+# the concurrency. Each request thread fans its model calls out over the
+# worker's shared grading pool, which bounds them at GRADING_MAX_WORKERS.
+worker_class = "gthread"
+workers = get_worker_count()
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+# Slightly longer than GRADING_BATCH_TIMEOUT so a slow batch is not killed mid-request
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers periodically to bound slow leaks
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+accesslog = "-"
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, so the encoder
+    # tables and rendered prompts are inherited by every worker
+    from warmup import warm_up
+
+    readiness = warm_up()
+    server.log.info(
+        "Warmed up in master: %s (rss %.1f MB, %d workers x %d threads)",
+        readiness["warmup_seconds"],
+        readiness["rss_mb"],
+        workers,
+        threads,
+    )
+
+
+def post_fork(server, worker):
+    # HTTP clients must not cross a fork, so each worker builds its own
+    # before it accepts traffic
+    from warmup import warm_up
+
+    readiness = warm_up()
+    for step, error in readiness["warmup_errors"].items():
+        worker.log.warning("Warm-up step %s failed: %s", step, error)
+
+    # Threads do not survive a fork either; each worker runs its own job workers
+    from job_queue import get_job_queue
+
+    get_job_queue().start()
+
+
+def post_request(worker, req, environ, resp):
+    from warmup import get_rss_bytes
+
+    rss_mb = get_rss_bytes() / 2**20
+    if rss_mb > GUNICORN_WORKER_MAX_RSS_MB:
+        worker.log.warning("Worker at %.1f MB RSS, restarting it", rss_mb)
+        worker.alive = False
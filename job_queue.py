@@ -0,0 +1,313 @@
+from metrics import get_metrics, start_request_usage, get_request_usage
+
+import json, os, sqlite3, threading, time, traceback, uuid
+
+# Grading runs submitted as jobs outlive the HTTP request that started them.
+# Jobs sit in a SQLite table shared by all gunicorn workers; each worker runs a
+# few background threads per lane that claim jobs under a lease. A job whose
+# lease runs out (its worker crashed or was recycled) is claimed again, up to
+# JOB_MAX_ATTEMPTS times.
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+# Threads per lane in each worker. Cover letters get their own lane so a burst
+# of long letters cannot hold up short answers.
+JOB_LANES = {
+    "questions": int(os.getenv("JOB_WORKERS_QUESTIONS", "2")),
+    "cover_letter": int(os.getenv("JOB_WORKERS_COVER_LETTER", "1")),
+}
+# Must exceed the longest grading run, or a slow job is run twice
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(60 * 60)))
+# Jobs waiting per lane, and per client across lanes, before submissions get a 429
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "200"))
+JOB_MAX_QUEUED_PER_CLIENT = int(os.getenv("JOB_MAX_QUEUED_PER_CLIENT", "10"))
+# Longest long-poll a client can ask for, and how many can hold a request
+# thread at once in each worker. Polls past the limit get the job's current
+# state straight away, so they never starve /ready or the grading routes.
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+JOB_MAX_LONG_POLLS = int(os.getenv("JOB_MAX_LONG_POLLS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.25"))
+
+
+class JobQueueFull(Exception):
+    def __init__(self, reason: str, retry_after: int = 10):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def record_job(lane: str, outcome: str) -> None:
+    get_metrics().inc("jobs_total", "Grading jobs by lane and outcome", lane=lane, outcome=outcome)
+
+
+class JobQueue:
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_PATH,
+        lanes: dict = JOB_LANES,
+        lease: float = JOB_LEASE,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        result_ttl: float = JOB_RESULT_TTL,
+    ):
+        self.path = path
+        self.lanes = lanes
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.handlers = {}
+        self._long_polls = threading.BoundedSemaphore(max(1, JOB_MAX_LONG_POLLS))
+        self._local = threading.local()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        # Wakes local long-polls and idle workers without waiting a poll interval
+        self._changed = threading.Condition()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, lane TEXT NOT NULL, client TEXT,"
+            "payload TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT,"
+            "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, started REAL,"
+            "lease_expires REAL, finished REAL, expires REAL)"
+        )
+        self._connect().execute(
+            "CREATE INDEX IF NOT EXISTS jobs_by_lane ON jobs (lane, status, created)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # As in grading_cache, one connection per thread and per forked process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def register(self, kind: str, lane: str, handler):
+        # `handler(payload)` returns the JSON result of the job
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown job lane {lane!r}")
+        self.handlers[kind] = (lane, handler)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def submit(self, kind: str, payload: dict, client: str = None) -> str:
+        lane = self.handlers[kind][0]
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (queued,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued'", (lane,)
+            ).fetchone()
+            if queued >= JOB_MAX_QUEUED:
+                raise JobQueueFull("The grading queue is full")
+            if client is not None:
+                (pending,) = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN ('queued', 'running')",
+                    (client,),
+                ).fetchone()
+                if pending >= JOB_MAX_QUEUED_PER_CLIENT:
+                    raise JobQueueFull("Too many jobs pending for this client")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, lane, client, payload, status, created) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, lane, client, json.dumps(payload), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            record_job(lane, "rejected")
+            raise
+
+        record_job(lane, "submitted")
+        self._notify()
+        return job_id
+
+    def claim(self, lane: str):
+        # The oldest queued job in the lane, or a running one whose lease ran out
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE expires <= ?", (now,))
+            # Jobs that keep killing their worker are not retried forever
+            for row in conn.execute(
+                "SELECT id FROM jobs WHERE lane = ? AND status = 'running' AND lease_expires <= ? "
+                "AND attempts >= ?",
+                (lane, now, self.max_attempts),
+            ).fetchall():
+                self._finish(conn, row["id"], "failed", error="Job did not finish")
+                record_job(lane, "failed")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE lane = ? AND (status = 'queued' "
+                "OR (status = 'running' AND lease_expires <= ?)) ORDER BY created LIMIT 1",
+                (lane, now),
+            ).fetchone()
+            if row is not None:
+                if row["status"] == "running":
+                    record_job(lane, "requeued")
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ?, "
+                    "lease_expires = ? WHERE id = ?",
+                    (now, now + self.lease, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, conn, job_id: str, status: str, result=None, error: str = None):
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, expires = ?, "
+            "payload = '{}' WHERE id = ?",
+            (status, json.dumps(result), error, now, now + self.result_ttl, job_id),
+        )
+
+    def run_job(self, row):
+        lane, handler = self.handlers[row["kind"]]
+        get_metrics().observe(
+            "job_queue_wait_seconds",
+            "Time jobs waited before a worker started them",
+            time.time() - row["created"],
+            lane=lane,
+        )
+        start_request_usage(f"job:{row['kind']}")
+        start = time.perf_counter()
+        try:
+            result = handler(json.loads(row["payload"]))
+        except Exception as e:
+            traceback.print_exc()
+            conn = self._connect()
+            if row["attempts"] + 1 < self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', lease_expires = NULL WHERE id = ?",
+                    (row["id"],),
+                )
+                record_job(lane, "retried")
+            else:
+                self._finish(conn, row["id"], "failed", error=f"{type(e).__name__}: {e}")
+                record_job(lane, "failed")
+        else:
+            self._finish(
+                self._connect(),
+                row["id"],
+                "done",
+                {"result": result, "usage": get_request_usage().to_dict()},
+            )
+            record_job(lane, "done")
+        get_metrics().observe(
+            "job_run_seconds", "Time spent running jobs", time.perf_counter() - start, lane=lane
+        )
+        self._notify()
+
+    def _work(self, lane: str):
+        while True:
+            try:
+                row = self.claim(lane)
+            except sqlite3.Error:
+                traceback.print_exc()
+                row = None
+            if row is None:
+                # Jobs submitted by other workers are only seen by polling
+                with self._changed:
+                    self._changed.wait(JOB_POLL_INTERVAL * 4)
+                continue
+            self.run_job(row)
+
+    def start(self):
+        # Idempotent per process; gunicorn workers start their own threads after the fork
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._changed = threading.Condition()
+            for lane, count in self.lanes.items():
+                for i in range(count):
+                    threading.Thread(
+                        target=self._work, args=(lane,), name=f"job-{lane}-{i}", daemon=True
+                    ).start()
+
+    def get(self, job_id: str):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT * FROM jobs WHERE id = ? AND (expires IS NULL OR expires > ?)",
+                (job_id, time.time()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created": row["created"],
+        }
+        if row["status"] == "queued":
+            (ahead,) = (
+                self._connect()
+                .execute(
+                    "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued' AND created < ?",
+                    (row["lane"], row["created"]),
+                )
+                .fetchone()
+            )
+            job["position"] = ahead
+        if row["status"] == "done":
+            job.update(json.loads(row["result"]))
+        if row["status"] == "failed":
+            job["error"] = row["error"]
+        return job
+
+    def wait(self, job_id: str, timeout: float):
+        # Long-poll: the job once it is done or failed, or as it stands at the
+        # timeout. Without a free long-poll slot it is returned as it stands now.
+        if not self._long_polls.acquire(blocking=False):
+            get_metrics().inc("job_long_polls_refused_total", "Long-polls answered at once")
+            return self.get(job_id)
+        try:
+            deadline = time.monotonic() + min(timeout, JOB_MAX_WAIT)
+            while True:
+                job = self.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                    return job
+                with self._changed:
+                    self._changed.wait(min(remaining, JOB_POLL_INTERVAL))
+        finally:
+            self._long_polls.release()
+
+    def queue_depth(self) -> int:
+        (queued,) = (
+            self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+        )
+        return queued
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
+
+
+get_metrics().register_callback(
+    "job_queue_depth",
+    "gauge",
+    "Grading jobs waiting for a worker",
+    lambda: get_job_queue().queue_depth(),
+)
@@ -0,0 +1,204 @@
+from dataclasses import dataclass, asdict
+from pydantic import BaseModel
+from typing import get_args, get_origin
+
+import hashlib, json, math, os, random, threading, time
+
+
+@dataclass
+class LLMUsage:
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cached_tokens: int = 0
+
+
+@dataclass
+class LLMResult:
+    parsed: BaseModel
+    refusal: str
+    usage: LLMUsage
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+class SimulatedRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Simulated rate limit, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+# Every backend takes the request kwargs (model, messages, temperature,
+# max_tokens), the response_format model, the per-attempt timeout, and the
+# caller's CallTiming, which it fills in with network and parse time.
+class LLMBackend:
+    def parse(self, request: dict, format, timeout: float, timing) -> LLMResult:
+        raise NotImplementedError
+
+
+def to_llm_result(completion) -> LLMResult:
+    message = completion.choices[0].message
+    details = getattr(completion.usage, "prompt_tokens_details", None)
+    usage = LLMUsage(
+        prompt_tokens=completion.usage.prompt_tokens,
+        completion_tokens=completion.usage.completion_tokens,
+        total_tokens=completion.usage.total_tokens,
+        cached_tokens=getattr(details, "cached_tokens", None) or 0,
+    )
+    return LLMResult(message.parsed, getattr(message, "refusal", None), usage)
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, get_client):
+        self.get_client = get_client
+
+    def parse(self, request: dict, format, timeout: float, timing) -> LLMResult:
+        network_start = time.perf_counter()
+        raw = self.get_client().beta.chat.completions.with_raw_response.parse(
+            **request, response_format=format, timeout=timeout
+        )
+        timing.network_latency += time.perf_counter() - network_start
+        parse_start = time.perf_counter()
+        result = to_llm_result(raw.parse())
+        timing.parse_time += time.perf_counter() - parse_start
+        return result
+
+
+def llm_result_to_dict(result: LLMResult) -> dict:
+    return {
+        "parsed": result.parsed.model_dump() if result.parsed else None,
+        "refusal": result.refusal,
+        "usage": asdict(result.usage),
+    }
+
+
+def llm_result_from_dict(value: dict, format) -> LLMResult:
+    parsed = format.model_validate(value["parsed"]) if value["parsed"] else None
+    return LLMResult(parsed, value["refusal"], LLMUsage(**value["usage"]))
+
+
+def make_request_key(request: dict, format) -> str:
+    schema = format.model_json_schema() if format is not None else None
+    payload = json.dumps([request, schema], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CassetteBackend(LLMBackend):
+    # Record/replay store: one JSON file per distinct request under `directory`.
+    # mode "replay" fails on a miss, "record" always calls `inner` and saves the
+    # result, and "auto" replays when it can and records otherwise.
+    def __init__(self, directory: str, mode: str = "replay", inner: LLMBackend = None):
+        if mode != "replay" and inner is None:
+            raise ValueError(f"Cassette mode {mode!r} needs a backend to record from")
+        self.directory = directory
+        self.mode = mode
+        self.inner = inner
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, request: dict, format, timing):
+        path = self._path(make_request_key(request, format))
+        if self.mode == "record" or not os.path.exists(path):
+            if self.mode == "replay":
+                raise CassetteMissError(f"No recording for request {os.path.basename(path)}")
+            return None
+
+        parse_start = time.perf_counter()
+        with open(path, "r") as f:
+            entry = json.load(f)
+        result = llm_result_from_dict(entry["response"], format)
+        timing.parse_time += time.perf_counter() - parse_start
+        return result
+
+    def _save(self, request: dict, format, result: LLMResult):
+        entry = {"request": request, "response": llm_result_to_dict(result)}
+        path = self._path(make_request_key(request, format))
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entry, f, indent=2, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def parse(self, request: dict, format, timeout: float, timing) -> LLMResult:
+        result = self._load(request, format, timing)
+        if result is None:
+            result = self.inner.parse(request, format, timeout, timing)
+            self._save(request, format, result)
+        return result
+
+
+def make_fake_value(annotation):
+    origin = get_origin(annotation)
+    if origin is list:
+        return []
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return make_fake_instance(annotation)
+    if annotation is bool:
+        return False
+    if annotation is int:
+        return 0
+    if annotation is float:
+        return 0.0
+    if annotation is str:
+        return "Simulated response."
+    args = [arg for arg in get_args(annotation) if arg is not type(None)]
+    return make_fake_value(args[0]) if args else None
+
+
+def make_fake_instance(format):
+    return format(
+        **{name: make_fake_value(field.annotation) for name, field in format.model_fields.items()}
+    )
+
+
+class FakeBackend(LLMBackend):
+    # Simulated model: log-normally distributed latency around `latency_median`
+    # seconds, a `rate_limit_rate` chance of a 429 per call, and schema-valid
+    # placeholder output (or whatever `responder(request, format)` returns).
+    # Seeded, so a benchmark run is reproducible.
+    def __init__(
+        self,
+        latency_median: float = 1.0,
+        latency_sigma: float = 0.5,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        completion_tokens: int = 80,
+        seed: int = 0,
+        responder=None,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.completion_tokens = completion_tokens
+        self.responder = responder or (lambda request, format: make_fake_instance(format))
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            latency = self.latency_median * math.exp(self._random.gauss(0, self.latency_sigma))
+            limited = self._random.random() < self.rate_limit_rate
+        return latency, limited
+
+    def _result(self, request: dict, format) -> LLMResult:
+        prompt = "".join(m.get("content") or "" for m in request["messages"])
+        prompt_tokens = max(1, len(prompt) // 4)
+        usage = LLMUsage(
+            prompt_tokens, self.completion_tokens, prompt_tokens + self.completion_tokens
+        )
+        return LLMResult(self.responder(request, format), None, usage)
+
+    def parse(self, request: dict, format, timeout: float, timing) -> LLMResult:
+        latency, limited = self._draw()
+        if limited:
+            raise SimulatedRateLimitError(self.retry_after)
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise TimeoutError("Simulated request timed out")
+        timing.network_latency += latency
+        return self._result(request, format)
@@ -0,0 +1,256 @@
+import openai
+import os, random, threading, time
+
+
+def get_limit(name: str):
+    # Client-side limits are off unless configured; 429s are handled either way
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+# Limits are per process; divide the org limits by the number of gunicorn workers
+LLM_REQUESTS_PER_MINUTE = get_limit("LLM_REQUESTS_PER_MINUTE")
+LLM_TOKENS_PER_MINUTE = get_limit("LLM_TOKENS_PER_MINUTE")
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "60"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    # Reservation-style bucket: callers take what they need up front, possibly
+    # driving the level negative, and wait until it would have refilled. That
+    # keeps callers in FIFO order instead of racing each other on every refill.
+    # A bucket without a rate never makes anyone wait.
+    def __init__(self, per_minute: float = None, capacity: float = None):
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.level -= amount
+            if self.level >= 0:
+                return 0.0
+            return -self.level / self.rate
+
+    def adjust(self, amount: float):
+        # Positive amounts give capacity back, negative ones take more
+        if self.rate is None:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.level, 0.0)
+
+
+class CircuitBreaker:
+    def __init__(
+        self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        # Thread running the half-open probe call, if any
+        self.prober = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        # While half open, one probe call is let through and its result closes
+        # or re-opens the breaker; everyone else is refused until then
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self.prober not in (None, threading.get_ident()):
+                return False
+            self.prober = threading.get_ident()
+            return True
+
+    def release(self):
+        # The probe ended without telling us anything about the API's health,
+        # e.g. with a 429 or a bad request, so the next caller probes instead
+        with self._lock:
+            if self.prober == threading.get_ident():
+                self.prober = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.prober = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.prober = None
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(
+        error,
+        (
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        ),
+    ):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def get_retry_after(error: Exception):
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+class RateLimitScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        timeout: float = LLM_CALL_DEADLINE,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.breaker = CircuitBreaker()
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def acquire(self, estimated_tokens: int, deadline: float) -> float:
+        if not self.breaker.allow():
+            raise CircuitOpenError("Too many consecutive model failures, not calling the API")
+
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if time.monotonic() + wait > deadline:
+            self.requests.adjust(1)
+            self.tokens.adjust(estimated_tokens)
+            self.breaker.release()
+            raise TimeoutError("Rate limit budget would not free up before the call deadline")
+        return wait
+
+    def settle(self, estimated_tokens: int, result):
+        usage = getattr(result, "usage", None)
+        actual = getattr(usage, "total_tokens", None)
+        if actual is not None:
+            self.tokens.adjust(estimated_tokens - actual)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter, but never sooner than the server asked us to wait
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2**attempt))
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if is_rate_limited(error):
+            # Everyone else in this process is about to hit the same limit
+            self.requests.drain()
+            self.tokens.drain()
+        return delay
+
+    def _handle_failure(
+        self, attempt: int, error: Exception, estimated_tokens: int, deadline: float
+    ) -> float:
+        # A failed call used none of the tokens reserved for it
+        self.tokens.adjust(estimated_tokens)
+        # Rate limits say nothing about the API's health; draining the buckets
+        # and honouring Retry-After already slow everyone down
+        if is_retryable(error) and not is_rate_limited(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        if not is_retryable(error):
+            raise error
+        if attempt >= self.max_retries:
+            raise error
+        delay = self.backoff(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            raise error
+        return delay
+
+    # `request` is called with the seconds left before the deadline, to use as
+    # the HTTP timeout for that attempt
+    def run(self, request, estimated_tokens: int, timeout: float = None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            time.sleep(self.acquire(estimated_tokens, deadline))
+            try:
+                result = request(deadline - time.monotonic())
+            except Exception as e:
+                time.sleep(self._handle_failure(attempt, e, estimated_tokens, deadline))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self.settle(estimated_tokens, result)
+            return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RateLimitScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RateLimitScheduler()
+    return _scheduler
+
+
+def set_scheduler(scheduler: RateLimitScheduler) -> None:
+    global _scheduler
+    _scheduler = scheduler
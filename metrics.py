@@ -0,0 +1,206 @@
+from contextvars import ContextVar
+import bisect, threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}
+        self._callbacks = []
+
+    def _declare(self, name: str, kind: str, help: str):
+        self._types.setdefault(name, kind)
+        self._help.setdefault(name, help)
+
+    def inc(self, name: str, help: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "counter", help)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, help: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "histogram", help)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # For values owned elsewhere (e.g. cache counters), read at scrape time
+    def register_callback(self, name: str, kind: str, help: str, callback):
+        with self._lock:
+            self._declare(name, kind, help)
+            self._callbacks.append((name, callback))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            samples = {}
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+
+            for (name, labels), histogram in self._histograms.items():
+                rows = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels + (("le", bound),))
+                    rows.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                rows.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                rows.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+            for name, callback in self._callbacks:
+                samples.setdefault(name, []).append(f"{name} {float(callback())}")
+
+            for name in sorted(samples):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._types[name]}")
+                lines.extend(samples[name])
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestUsage:
+    def __init__(self, route: str = None):
+        self.route = route
+        self.calls = 0
+        self.tokens_in = 0
+        self.cached_tokens_in = 0
+        self.tokens_out = 0
+        self.queue_wait = 0.0
+        self.network_latency = 0.0
+        self.parse_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, tokens_in, cached_tokens_in, tokens_out, queue_wait, network_latency, parse_time):
+        with self._lock:
+            self.calls += 1
+            self.tokens_in += tokens_in
+            self.cached_tokens_in += cached_tokens_in
+            self.tokens_out += tokens_out
+            self.queue_wait += queue_wait
+            self.network_latency += network_latency
+            self.parse_time += parse_time
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "llm_calls": self.calls,
+                "tokens_in": self.tokens_in,
+                "cached_tokens_in": self.cached_tokens_in,
+                "tokens_out": self.tokens_out,
+                "queue_wait": round(self.queue_wait, 4),
+                "network_latency": round(self.network_latency, 4),
+                "parse_time": round(self.parse_time, 4),
+            }
+
+
+_registry = MetricsRegistry()
+_request_usage: ContextVar[RequestUsage] = ContextVar("request_usage", default=None)
+
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+
+# Work submitted to thread pools must run under contextvars.copy_context() for
+# its calls to be attributed to the request that started it
+def start_request_usage(route: str = None) -> RequestUsage:
+    usage = RequestUsage(route)
+    _request_usage.set(usage)
+    return usage
+
+
+def get_request_usage() -> RequestUsage:
+    return _request_usage.get()
+
+
+def record_llm_call(
+    endpoint: str,
+    model: str,
+    tokens_in: int,
+    cached_tokens_in: int,
+    tokens_out: int,
+    queue_wait: float,
+    network_latency: float,
+    parse_time: float,
+):
+    labels = {"endpoint": endpoint or "default", "model": model}
+
+    _registry.inc("llm_calls_total", "Model calls made", **labels)
+    _registry.inc("llm_prompt_tokens_total", "Prompt tokens sent", tokens_in, **labels)
+    _registry.inc(
+        "llm_cached_prompt_tokens_total",
+        "Prompt tokens served from the provider prompt cache",
+        cached_tokens_in,
+        **labels,
+    )
+    _registry.inc("llm_completion_tokens_total", "Completion tokens received", tokens_out, **labels)
+    _registry.observe(
+        "llm_queue_wait_seconds",
+        "Time spent waiting on rate limits and retry backoff",
+        queue_wait,
+        **labels,
+    )
+    _registry.observe(
+        "llm_network_latency_seconds", "Time spent in the HTTP call", network_latency, **labels
+    )
+    _registry.observe(
+        "llm_parse_seconds", "Time spent parsing structured output", parse_time, **labels
+    )
+
+    usage = _request_usage.get()
+    if usage is not None:
+        usage.add(tokens_in, cached_tokens_in, tokens_out, queue_wait, network_latency, parse_time)
+
+
+def record_llm_error(endpoint: str, model: str, error: Exception):
+    _registry.inc(
+        "llm_errors_total",
+        "Model calls that failed after retries",
+        endpoint=endpoint or "default",
+        model=model,
+        error=type(error).__name__,
+    )
+
+
+def record_http_request(route: str, method: str, status: int, duration: float):
+    _registry.inc(
+        "http_requests_total", "HTTP requests served", route=route, method=method, status=status
+    )
+    _registry.observe(
+        "http_request_duration_seconds",
+        "End-to-end HTTP request latency",
+        duration,
+        route=route,
+        method=method,
+    )
@@ -0,0 +1,134 @@
+from openai_utils import call_gpt_formatted
+from llm_scheduler import CircuitOpenError
+from metrics import get_metrics
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+
+import os
+
+ROUTING_SMALL_MODEL = os.getenv("ROUTING_SMALL_MODEL", "gpt-4o-mini")
+ROUTING_LARGE_MODEL = os.getenv("ROUTING_LARGE_MODEL", "gpt-4o-2024-08-06")
+# Small-model samples per tiered call when the caller can compare results;
+# samples that disagree are escalated to the large model
+ROUTING_SAMPLES = int(os.getenv("ROUTING_SAMPLES", "2"))
+# Comma separated endpoint=policy pairs. "large" always uses the large model,
+# "small" always uses the small one, and "tiered" tries the small model first.
+# Endpoints that are not listed use the large model.
+MODEL_ROUTING = os.getenv(
+    "MODEL_ROUTING", "check_answer=tiered,info_requests=tiered,reduce_requests=tiered"
+)
+ROUTING_MODES = ("large", "small", "tiered")
+
+# Extra samples run here rather than on the grading pool, whose threads are
+# the ones waiting on them
+_sample_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ROUTING_SAMPLE_WORKERS", "8")), thread_name_prefix="routing"
+)
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    mode: str
+    small_model: str = ROUTING_SMALL_MODEL
+    large_model: str = ROUTING_LARGE_MODEL
+    samples: int = ROUTING_SAMPLES
+
+    @property
+    def tag(self) -> str:
+        # Part of the grading cache key, so results are never shared across policies
+        if self.mode == "large":
+            return self.large_model
+        if self.mode == "small":
+            return self.small_model
+        return f"tiered:{self.small_model}x{self.samples}>{self.large_model}"
+
+
+def parse_routing(spec: str) -> dict[str, RoutingPolicy]:
+    policies = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        endpoint, _, mode = item.partition("=")
+        mode = mode.strip().lower()
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing policy {mode!r} for endpoint {endpoint.strip()!r}")
+        policies[endpoint.strip()] = RoutingPolicy(mode)
+    return policies
+
+
+ROUTING_POLICIES = parse_routing(MODEL_ROUTING)
+
+
+def get_routing_policy(endpoint: str) -> RoutingPolicy:
+    return ROUTING_POLICIES.get(endpoint, RoutingPolicy("large"))
+
+
+def fixed_policy(model: str) -> RoutingPolicy:
+    return RoutingPolicy("large", large_model=model)
+
+
+def record_route(endpoint: str, outcome: str) -> None:
+    get_metrics().inc(
+        "llm_routing_total",
+        "Tiered model calls by outcome; escalated_* went on to the large model",
+        endpoint=endpoint or "default",
+        outcome=outcome,
+    )
+
+
+def escalation_reason(results: list, agreement_key) -> str:
+    if any(not response for response, _, _, _ in results):
+        return "refusal"
+    if agreement_key is not None and len({agreement_key(r[0]) for r in results}) > 1:
+        return "disagreement"
+    return None
+
+
+def combine_usage(attempts: list, final):
+    # Report every call made for the request, not just the one that answered
+    response, _, _, reason = final
+    tokens_in = sum(result[1] for result in attempts)
+    tokens_out = sum(result[2] for result in attempts)
+    return response, tokens_in, tokens_out, reason
+
+
+def _call_model(messages, format, model: str, temp: float, endpoint: str, sample: int = 0):
+    return call_gpt_formatted(
+        messages, format, model=model, temp=temp, endpoint=endpoint, sample=sample
+    )
+
+
+# Same return value as call_gpt_formatted. `agreement_key` maps a parsed
+# response to the fields that must match across small-model samples; without
+# it a single sample is taken and only refusals and errors escalate.
+def call_routed(
+    messages, format, endpoint: str, temp: float = 0.1, agreement_key=None, policy=None
+):
+    policy = policy or get_routing_policy(endpoint)
+    if policy.mode != "tiered":
+        model = policy.small_model if policy.mode == "small" else policy.large_model
+        return _call_model(messages, format, model, temp, endpoint)
+
+    samples = max(1, policy.samples) if agreement_key is not None else 1
+    args = (messages, format, policy.small_model, temp, endpoint)
+    try:
+        extra = [
+            _sample_pool.submit(copy_context().run, _call_model, *args, sample)
+            for sample in range(1, samples)
+        ]
+        attempts = [_call_model(*args)] + [future.result() for future in extra]
+        outcome = escalation_reason(attempts, agreement_key)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        print(f"Small model failed, escalating:\n {type(e).__name__}: {e}\n")
+        attempts, outcome = [], "error"
+
+    if outcome is None:
+        record_route(endpoint, "small")
+        return combine_usage(attempts, attempts[0])
+
+    record_route(endpoint, f"escalated_{outcome}")
+    final = _call_model(messages, format, policy.large_model, temp, endpoint)
+    return combine_usage(attempts + [final], final)
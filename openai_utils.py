@@ -1,26 +1,76 @@
 from config import *
 from openai import OpenAI
-import openai, tiktoken
-import json
+from openai.lib._parsing._completions import type_to_response_format_param
+from token_utils import count_tokens, count_tokens_many, estimate_tokens, fits_token_budget
+from llm_scheduler import get_scheduler
+from metrics import record_llm_call, record_llm_error
+from llm_backends import CassetteBackend, FakeBackend, LLMBackend, LLMResult, OpenAIBackend
+from llm_backends import llm_result_from_dict, llm_result_to_dict, make_request_key
+from single_flight import SINGLE_FLIGHT, get_single_flight, record_single_flight
+import openai, httpx
+import json, os, threading, time
 from pydantic import BaseModel
 
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+# Completion tokens reserved against the tokens/min budget before usage is known
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("EXPECTED_COMPLETION_TOKENS", "400"))
 
-class TokenUsageTracker:
+
+class OpenAIClientManager:
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
-            cls._instance = super(TokenUsageTracker, cls).__new__(cls, *args, **kwargs)
-            cls._instance.tokens_in = 0  # Initialize the token in usage attribute
-            cls._instance.tokens_out = 0  # Initialize the token out usage attribute
+            cls._instance = super(OpenAIClientManager, cls).__new__(cls, *args, **kwargs)
+            cls._instance._lock = threading.Lock()
+            cls._instance._reset()
         return cls._instance
 
-    def add_tokens(self, tokens_in: int, tokens_out: int):
-        self.tokens_in += tokens_in
-        self.tokens_out += tokens_out
+    def _reset(self):
+        # Sockets must never be shared between a gunicorn master and its
+        # workers, so every process builds its own pool on first use.
+        self._pid = os.getpid()
+        self._client = None
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        )
+
+    def _timeout(self):
+        return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+    def get_client(self) -> OpenAI:
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+                if self._client is None:
+                    # Retries are handled by llm_scheduler, not the SDK
+                    self._client = OpenAI(
+                        timeout=self._timeout(),
+                        max_retries=0,
+                        http_client=openai.DefaultHttpxClient(limits=self._limits()),
+                    )
+        return self._client
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._reset()
+
 
-    def get_usage(self):
-        return self.tokens_in, self.tokens_out
+def get_openai_client() -> OpenAI:
+    return OpenAIClientManager().get_client()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: OpenAIClientManager().after_fork())
 
 
 class GPTResponse(BaseModel):
@@ -80,65 +130,193 @@ class ResponseJSONList(BaseModel):
         return json.dumps(self.to_dict(), indent=2)
     
 
-def count_tokens(message: str):
-    model = "gpt-4"
-    encoding = tiktoken.encoding_for_model(model)
-    token_count = len(encoding.encode(message))
+def estimate_request_tokens(messages, model, max_tokens) -> int:
+    prompt = "".join(m["content"] for m in messages if isinstance(m.get("content"), str))
+    return count_tokens(prompt, model) + min(max_tokens, EXPECTED_COMPLETION_TOKENS)
 
-    return int(token_count)
 
+class CallTiming:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.network_latency = 0.0
+        self.parse_time = 0.0
 
-def call_gpt_formatted(
-    messages, format, model="gpt-4o-2024-08-06", temp=0.1, verbose=False, max_tokens=4069
+    # Everything that was neither the HTTP call nor parsing: rate-limit waits,
+    # retry backoff and the failed attempts themselves
+    @property
+    def queue_wait(self) -> float:
+        return max(0.0, time.perf_counter() - self.start - self.network_latency - self.parse_time)
+
+
+_llm_backend = None
+_llm_backend_lock = threading.Lock()
+
+
+def make_llm_backend_from_env() -> LLMBackend:
+    # LLM_BACKEND selects what sits under call_gpt_formatted: the real API
+    # ("openai"), a simulated model ("fake"), or a cassette store in
+    # LLM_CASSETTE_DIR ("replay", "record" or "auto", recording from the API)
+    name = os.getenv("LLM_BACKEND", "openai")
+    openai_backend = OpenAIBackend(get_openai_client)
+
+    if name == "openai":
+        return openai_backend
+    if name == "fake":
+        return FakeBackend(
+            latency_median=float(os.getenv("FAKE_LLM_LATENCY_MEDIAN", "1.0")),
+            latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+            rate_limit_rate=float(os.getenv("FAKE_LLM_429_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+        )
+    if name in ("replay", "record", "auto"):
+        return CassetteBackend(os.getenv("LLM_CASSETTE_DIR", "cassettes"), name, openai_backend)
+    raise ValueError(f"Unknown LLM_BACKEND {name!r}")
+
+
+def get_llm_backend() -> LLMBackend:
+    global _llm_backend
+    if _llm_backend is None:
+        with _llm_backend_lock:
+            if _llm_backend is None:
+                _llm_backend = make_llm_backend_from_env()
+    return _llm_backend
+
+
+def set_llm_backend(backend: LLMBackend) -> None:
+    global _llm_backend
+    _llm_backend = backend
+
+
+def response_format_param(format) -> dict:
+    # The response_format the SDK sends for a pydantic model. The helper is
+    # private, so the openai version is capped in pyproject.toml.
+    return type_to_response_format_param(format)
+
+
+def single_flight_key(request: dict, format, sample: int) -> str:
+    # Routing samples of one request are meant to be independent draws, so
+    # only the same sample of identical requests is coalesced
+    key = make_request_key(request, format)
+    return f"{key}/{sample}" if sample else key
+
+
+def _unpack_formatted(
+    response: LLMResult,
+    messages,
+    model,
+    timing: CallTiming,
+    verbose=False,
+    endpoint=None,
+    shared=False,
 ):
-    client = OpenAI()
-
-    response = client.beta.chat.completions.parse(
-        model=model,
-        messages=messages,
-        temperature=temp,
-        max_tokens=max_tokens,
-        response_format=format,
-    )
+    if shared:
+        # Another caller's identical request paid for this response
+        record_single_flight(endpoint, "coalesced")
+        if response.parsed:
+            return response.parsed, 0, 0, None
+        return "", 0, 0, "Refusal"
 
-    message = response.choices[0].message
     tokens_in = response.usage.prompt_tokens
     tokens_out = response.usage.completion_tokens
 
-    TokenUsageTracker().add_tokens(tokens_in, tokens_out)
+    if SINGLE_FLIGHT:
+        record_single_flight(endpoint, "called")
+    record_llm_call(
+        endpoint,
+        model,
+        tokens_in,
+        response.usage.cached_tokens,
+        tokens_out,
+        timing.queue_wait,
+        timing.network_latency,
+        timing.parse_time,
+    )
 
     if verbose and False:
         print("User: ")
         print(messages[-1]["content"][:200])
         print("GPT: ")
-        print(message)
+        print(response.parsed)
         print()
 
-    if message.parsed:
-        return message.parsed, tokens_in, tokens_out, None
+    if response.parsed:
+        return response.parsed, tokens_in, tokens_out, None
     else:
         return "", tokens_in, tokens_out, "Refusal"
 
 
+def call_gpt_formatted(
+    messages,
+    format,
+    model="gpt-4o-2024-08-06",
+    temp=0.1,
+    verbose=False,
+    max_tokens=4069,
+    endpoint=None,
+    sample=0,
+):
+    backend = get_llm_backend()
+    timing = CallTiming()
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temp,
+        "max_tokens": max_tokens,
+    }
+
+    estimated_tokens = estimate_request_tokens(messages, model, max_tokens)
+
+    def call():
+        return get_scheduler().run(
+            lambda timeout: backend.parse(request, format, timeout, timing), estimated_tokens
+        )
+
+    shared = False
+    try:
+        if SINGLE_FLIGHT:
+            response, shared = get_single_flight().run(
+                single_flight_key(request, format, sample),
+                call,
+                llm_result_to_dict,
+                lambda value: llm_result_from_dict(value, format),
+            )
+        else:
+            response = call()
+    except Exception as e:
+        record_llm_error(endpoint, model, e)
+        raise
+
+    return _unpack_formatted(response, messages, model, timing, verbose, endpoint, shared)
+
+
 def call_gpt(
     messages, model="gpt-4o", temp=0.1, tools=[], verbose=False, max_tokens=4069
 ):
 
-    client = OpenAI()
+    client = get_openai_client()
 
-    if len(tools) == 0:
-        response = client.chat.completions.create(
-            model=model, messages=messages, temperature=temp, max_tokens=max_tokens
-        )
-    else:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temp,
-            parallel_tool_calls=False,
-            tools=tools,
-            tool_choice="required",
-        )
+    def request(timeout):
+        if len(tools) == 0:
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tokens,
+                timeout=timeout,
+            )
+        else:
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                parallel_tool_calls=False,
+                tools=tools,
+                tool_choice="required",
+                timeout=timeout,
+            )
+
+    estimated_tokens = estimate_request_tokens(messages, model, max_tokens)
+    response = get_scheduler().run(request, estimated_tokens)
 
     tokens_in = response.usage.prompt_tokens
     tokens_out = response.usage.completion_tokens
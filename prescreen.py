@@ -0,0 +1,160 @@
+from rule_index import RULE_TAGS, match_words
+from dataclasses import dataclass
+import os, re
+
+# Cheap local checks for answers that fail the default short-answer rules for
+# obvious reasons. "on" answers high-confidence failures without a model call
+# and grades medium-confidence ones on PRESCREEN_MODEL, "flag" only attaches
+# the flags to the feedback, and "off" skips the stage. The thresholds have not
+# been checked against real answers yet, so the default only flags.
+PRESCREEN_MODE = os.getenv("PRESCREEN_MODE", "flag").lower()
+PRESCREEN_MODEL = os.getenv("PRESCREEN_MODEL", "gpt-4o-mini")
+PRESCREEN_HIGH_CONFIDENCE = float(os.getenv("PRESCREEN_HIGH_CONFIDENCE", "0.9"))
+PRESCREEN_MEDIUM_CONFIDENCE = float(os.getenv("PRESCREEN_MEDIUM_CONFIDENCE", "0.6"))
+PRESCREEN_MIN_WORDS = int(os.getenv("PRESCREEN_MIN_WORDS", "4"))
+
+
+@dataclass(frozen=True)
+class PrescreenFlag:
+    rule_id: str
+    # The AnswerReason field the flag would set
+    field: str
+    confidence: float
+    reason: str
+
+    def to_dict(self) -> dict:
+        return {
+            "rule_id": self.rule_id,
+            "field": self.field,
+            "confidence": self.confidence,
+            "reason": self.reason,
+        }
+
+
+WORD_PATTERN = re.compile(r"\w+")
+# Brief answers are fine when they point back to the cover letter
+REFERENCE_PATTERN = match_words(
+    r"cover letter", r"see (?:attached|above|below)", r"exhibit", r"affidavit"
+)
+ECONOMIC_PATTERN = RULE_TAGS["economic"]
+PERSECUTION_PATTERN = match_words(
+    r"persecut",
+    r"threat",
+    r"harass",
+    r"torture",
+    r"arrest",
+    r"detain",
+    r"prison",
+    r"jail",
+    r"beat",
+    r"attack",
+    r"kill",
+    r"murder",
+    r"rape",
+    r"assault",
+    r"kidnap",
+    r"danger",
+    r"government",
+    r"police",
+    r"military",
+    r"army",
+    r"soldier",
+    r"authorit",
+    r"militia",
+    r"gang",
+    r"cartel",
+)
+# Economic answers are expected for employment, income and asset questions;
+# only a persecution or fear-of-return question makes them a likely violation
+PERSECUTION_QUESTION_PATTERN = match_words(
+    r"persecut",
+    r"harm",
+    r"mistreat",
+    r"threat",
+    r"torture",
+    r"fear",
+    r"afraid",
+    r"return",
+    r"go back",
+    r"leave",
+    r"left",
+    r"fle(?:e|d)\b",
+    r"flight",
+)
+# Harm tied to a protected ground is persecution too, e.g. losing a job for
+# joining an opposition party
+PROTECTED_GROUND_PATTERN = RULE_TAGS["protected_ground"]
+VAGUE_PRONOUN_PATTERN = re.compile(r"\b(?:they|them|their)\b", re.IGNORECASE)
+PERPETRATOR_PATTERN = match_words(
+    r"government",
+    r"police",
+    r"officers?\b",
+    r"military",
+    r"army",
+    r"soldiers?\b",
+    r"authorities",
+    r"militia",
+    r"gang",
+    r"cartel",
+    r"party\b",
+    r"members? of",
+    r"guerrill",
+    r"rebels?\b",
+    r"regime",
+)
+
+
+def check_short_answer(question: str, answer: str) -> list[PrescreenFlag]:
+    words = len(WORD_PATTERN.findall(answer))
+    if words == 0:
+        return [PrescreenFlag("empty-answer", "missing_info", 1.0, "The answer is empty.")]
+    # "No." or "Not applicable" fully answers many I-589 questions, so a short
+    # answer is only ever sent for a second look
+    if words < PRESCREEN_MIN_WORDS and not REFERENCE_PATTERN.search(answer):
+        reason = "The answer may be too short to address the question."
+        return [PrescreenFlag("short-answer", "missing_info", 0.7, reason)]
+    return []
+
+
+def check_economic_only(question: str, answer: str) -> list[PrescreenFlag]:
+    # Economic hardship is only relevant when tied to persecution, so an
+    # answer to a persecution question with no sign of persecution at all is
+    # a likely violation
+    economic = len(ECONOMIC_PATTERN.findall(answer))
+    if (
+        economic == 0
+        or not PERSECUTION_QUESTION_PATTERN.search(question)
+        or PERSECUTION_PATTERN.search(answer)
+        or PROTECTED_GROUND_PATTERN.search(answer)
+    ):
+        return []
+    confidence = 0.9 if economic >= 2 else 0.7
+    reason = "The answer argues economic hardship without tying it to persecution."
+    return [PrescreenFlag("economic-hardship", "rule_violation", confidence, reason)]
+
+
+def check_vague_perpetrators(question: str, answer: str) -> list[PrescreenFlag]:
+    # A regex cannot resolve antecedents, so this only ever asks for a second look
+    if not VAGUE_PRONOUN_PATTERN.search(answer) or PERPETRATOR_PATTERN.search(answer):
+        return []
+    reason = "The answer refers to 'they' without naming who the perpetrators are."
+    return [PrescreenFlag("specify-perpetrators", "rule_violation", 0.6, reason)]
+
+
+MATCHERS = (check_short_answer, check_economic_only, check_vague_perpetrators)
+
+
+def prescreen_answer(question) -> list[PrescreenFlag]:
+    # `question` is an asylum_check.FormQuestion
+    answer = question.answer or ""
+    flags = []
+    for matcher in MATCHERS:
+        flags.extend(matcher(question.question, answer))
+        # Nothing else can be judged about an empty or near-empty answer
+        if flags and flags[0].field == "missing_info":
+            break
+    return flags
+
+
+def prescreen_confidence(flags: list[PrescreenFlag]) -> float:
+    return max((flag.confidence for flag in flags), default=0.0)
@@ -0,0 +1,260 @@
+from asylum_ruleset import RuleSet, make_rule_set
+from collections import Counter
+from functools import lru_cache
+
+import math, os, re
+
+# Number of non-core rules to send with each default-rules grading prompt.
+# 0 sends the whole rule set, as before.
+RULE_SELECTION_TOP_K = int(os.getenv("RULE_SELECTION_TOP_K", "0"))
+# Always sent, ahead of the selected rules so they stay in the cached prompt prefix
+RULE_SELECTION_CORE = tuple(
+    os.getenv(
+        "RULE_SELECTION_CORE",
+        "government-tie,protected-ground,specify-perpetrators,brief-summaries",
+    ).split(",")
+)
+# Added to a rule's lexical score for each of its categories the text touches
+TAG_BOOST = 2.0
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_top_k = RULE_SELECTION_TOP_K
+
+
+def match_words(*words: str) -> re.Pattern:
+    return re.compile(r"\b(?:" + "|".join(words) + r")", re.IGNORECASE)
+
+
+# Categories a question/answer can touch, and the rules each one makes relevant
+RULE_TAGS = {
+    "economic": match_words(
+        r"jobs?\b",
+        r"work",
+        r"employ",
+        r"unemploy",
+        r"money",
+        r"poverty",
+        r"poor\b",
+        r"econom",
+        r"afford",
+        r"salar",
+        r"wages?\b",
+        r"business",
+        r"property",
+        r"livelihood",
+        r"opportunit",
+        r"feed my family",
+        r"better life",
+    ),
+    "government": match_words(
+        r"government",
+        r"police",
+        r"military",
+        r"army",
+        r"soldier",
+        r"official",
+        r"authorit",
+        r"state\b",
+        r"report",
+        r"protect",
+    ),
+    "protected_ground": match_words(
+        r"religio",
+        r"politic",
+        r"party\b",
+        r"opposition",
+        r"opinion",
+        r"ethnic",
+        r"race\b",
+        r"tribe",
+        r"nationality",
+        r"social group",
+        r"gay\b",
+        r"lesbian",
+        r"lgbt",
+        r"christian",
+        r"muslim",
+    ),
+    "perpetrator": match_words(
+        r"they\b",
+        r"them\b",
+        r"gangs?\b",
+        r"militia",
+        r"attackers?\b",
+        r"men\b",
+        r"people\b",
+    ),
+    "harm": match_words(
+        r"tortur",
+        r"beat",
+        r"kill",
+        r"threat",
+        r"attack",
+        r"rape",
+        r"arrest",
+        r"detain",
+        r"prison",
+        r"jail",
+        r"harm",
+        r"hurt",
+        r"persecut",
+        r"danger",
+    ),
+    "evidence": match_words(
+        r"evidence",
+        r"document",
+        r"medical",
+        r"affidavit",
+        r"photo",
+        r"exhibit",
+        r"witness",
+        r"news",
+        r"record",
+        r"proof",
+        r"letter",
+    ),
+    "timing": match_words(
+        r"arriv",
+        r"enter",
+        r"year",
+        r"date",
+        r"deport",
+        r"when\b",
+        r"fil(?:e|ed|ing)\b",
+    ),
+    "bars": match_words(
+        r"convict",
+        r"crim",
+        r"resettl",
+        r"third country",
+        r"citizenship",
+        r"status",
+        r"lived in",
+    ),
+    "protection": match_words(
+        r"asylum",
+        r"withholding",
+        r"convention",
+        r"i-589",
+        r"refugee",
+        r"return",
+        r"go back",
+    ),
+}
+
+RULE_CATEGORIES = {
+    "no-economic-uncertainty": ("economic",),
+    "economic-hardship": ("economic",),
+    "above-general-hardship": ("economic", "harm"),
+    "government-tie": ("government",),
+    "government-protection": ("government", "perpetrator"),
+    "government-involvement": ("government", "harm"),
+    "protected-ground": ("protected_ground",),
+    "central-reason": ("protected_ground", "harm"),
+    "refugee-convention": ("protected_ground", "protection"),
+    "specify-perpetrators": ("perpetrator",),
+    "cat-withholding": ("harm", "protection"),
+    "credible-testimony": ("harm", "evidence"),
+    "exhibits": ("evidence",),
+    "corroboration": ("evidence",),
+    "detailed-cover-letter": ("evidence",),
+    "one-year-filing": ("timing", "bars"),
+    "bars-to-asylum": ("bars",),
+    "all-three-protections": ("protection",),
+    "consistency": (),
+    "brief-summaries": (),
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have i if in is it its me my not of on or "
+    "our so that the their them they this to was we were what when which who why will with "
+    "you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    # Lowercased words with a crude suffix strip, enough to match "persecuted"
+    # against "persecution"
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        for suffix in ("ation", "ing", "ion", "ed", "es", "s"):
+            if len(word) > len(suffix) + 3 and word.endswith(suffix):
+                word = word[: -len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+class RuleIndex:
+    # BM25 over the rule texts plus a boost for matching categories. Built once
+    # per rule set; scoring a query is a few dictionary lookups per rule.
+    def __init__(self, rule_set: RuleSet):
+        self.rule_set = rule_set
+        self.docs = [Counter(tokenize(rule.text)) for rule in rule_set.rules]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.average_length = sum(self.lengths) / max(1, len(self.lengths))
+        frequencies = Counter(term for doc in self.docs for term in doc)
+        count = len(self.docs)
+        self.idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in frequencies.items()
+        }
+
+    def score(self, text: str) -> list[float]:
+        terms = Counter(tokenize(text))
+        tags = {tag for tag, pattern in RULE_TAGS.items() if pattern.search(text)}
+        scores = []
+        for rule, doc, length in zip(self.rule_set.rules, self.docs, self.lengths):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+            lexical = sum(
+                self.idf[term] * doc[term] * (BM25_K1 + 1) / (doc[term] + norm)
+                for term in terms
+                if term in doc
+            )
+            boost = TAG_BOOST * len(tags.intersection(RULE_CATEGORIES.get(rule.id, ())))
+            scores.append(lexical + boost)
+        return scores
+
+    def select(self, text: str, top_k: int) -> RuleSet:
+        ids = {rule.id for rule in self.rule_set.rules}
+        core = [rule_id for rule_id in RULE_SELECTION_CORE if rule_id in ids]
+        candidates = [
+            (score, i)
+            for i, (rule, score) in enumerate(zip(self.rule_set.rules, self.score(text)))
+            if rule.id not in core and score > 0
+        ]
+        chosen = sorted(i for _, i in sorted(candidates, key=lambda c: (-c[0], c[1]))[:top_k])
+        return make_selected_rule_set(
+            self.rule_set.name,
+            tuple(core) + tuple(self.rule_set.rules[i].id for i in chosen),
+        )
+
+
+@lru_cache(maxsize=1024)
+def make_selected_rule_set(name: str, rule_ids: tuple[str, ...]) -> RuleSet:
+    # Equal selections share one RuleSet, and so one rendered prompt string
+    return make_rule_set(f"{name}:selected", list(rule_ids))
+
+
+@lru_cache(maxsize=None)
+def get_rule_index(rule_set: RuleSet) -> RuleIndex:
+    return RuleIndex(rule_set)
+
+
+def get_rule_selection_top_k() -> int:
+    return _top_k
+
+
+def set_rule_selection_top_k(top_k: int) -> None:
+    global _top_k
+    _top_k = top_k
+
+
+def select_rules(rule_set: RuleSet, text: str, top_k: int = None) -> RuleSet:
+    top_k = get_rule_selection_top_k() if top_k is None else top_k
+    if top_k <= 0 or top_k + len(RULE_SELECTION_CORE) >= len(rule_set.rules):
+        return rule_set
+    return get_rule_index(rule_set).select(text, top_k)
@@ -0,0 +1,194 @@
+from metrics import get_metrics
+from rule_index import RULE_TAGS
+from collections import OrderedDict
+
+import hashlib, os, random, re, threading
+
+# Serves a stored grade for an answer that is nearly identical to one already
+# graded against the same question and rules. Answers are compared on word
+# shingles: MinHash signatures split into LSH bands find candidates, and the
+# exact Jaccard similarity of the shingle sets decides. A match must also use
+# the same negations and rule vocabulary, since "I was not persecuted" shares
+# most shingles with "I was persecuted". "shadow" looks matches up and
+# compares them with the model's grade without serving them.
+SIMILARITY_CACHE_MODE = os.getenv("SIMILARITY_CACHE", "off")
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.9"))
+SIMILARITY_CACHE_SIZE = int(os.getenv("SIMILARITY_CACHE_SIZE", "4096"))
+# Shorter answers are left to the exact cache: one changed word in a short
+# answer can change its meaning
+SIMILARITY_MIN_WORDS = int(os.getenv("SIMILARITY_MIN_WORDS", "8"))
+SHINGLE_SIZE = 3
+# 16 bands of 4 rows make pairs above ~0.5 similarity likely candidates, well
+# below any sensible threshold
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+MINHASH_PRIME = (1 << 61) - 1
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+NEGATION_WORDS = frozenset("no not never nor none nothing nobody neither without cannot".split())
+
+_random = random.Random(0)
+MINHASH_PERMUTATIONS = [
+    (_random.randrange(1, MINHASH_PRIME), _random.randrange(0, MINHASH_PRIME))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+
+def normalize_answer(text: str) -> list[str]:
+    # Case, punctuation and spacing differences do not count; every word does
+    return WORD_PATTERN.findall(text.lower().replace("’", "'"))
+
+
+def make_shingles(words: list[str]) -> frozenset:
+    return frozenset(
+        int.from_bytes(
+            hashlib.blake2b(" ".join(words[i : i + SHINGLE_SIZE]).encode(), digest_size=8).digest(),
+            "big",
+        )
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    )
+
+
+def make_signature(shingles: frozenset) -> tuple:
+    return tuple(
+        min((a * s + b) % MINHASH_PRIME for s in shingles) for a, b in MINHASH_PERMUTATIONS
+    )
+
+
+def make_key_terms(words: list[str], text: str) -> tuple:
+    # Words that can flip a grade on their own however similar the rest is:
+    # negations, and the terms the rule index tags answers by
+    negations = sorted(word for word in words if word in NEGATION_WORDS or word.endswith("n't"))
+    vocabulary = {
+        match.lower() for pattern in RULE_TAGS.values() for match in pattern.findall(text)
+    }
+    return tuple(negations), tuple(sorted(vocabulary))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def record_similarity(name: str, help: str, outcome: str) -> None:
+    get_metrics().inc(name, help, outcome=outcome)
+
+
+class SimilarityCache:
+    # Bounded LRU of graded answers with an LSH index over them. `namespace`
+    # separates answers graded against different questions, rules or models.
+    def __init__(
+        self,
+        mode: str = SIMILARITY_CACHE_MODE,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_size: int = SIMILARITY_CACHE_SIZE,
+    ):
+        self.mode = mode
+        self.enabled = mode in ("on", "shadow") and max_size > 0
+        self.threshold = threshold
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, namespace: str, signature: tuple) -> list:
+        return [
+            (namespace, band, signature[band * MINHASH_ROWS : (band + 1) * MINHASH_ROWS])
+            for band in range(MINHASH_BANDS)
+        ]
+
+    def _shingle(self, text: str):
+        text = text or ""
+        words = normalize_answer(text)
+        if len(words) < SIMILARITY_MIN_WORDS:
+            return None
+        return make_shingles(words), make_key_terms(words, text)
+
+    def lookup(self, namespace: str, text: str):
+        # The stored value of the most similar answer above the threshold
+        if not self.enabled:
+            return None
+        shingled = self._shingle(text)
+        if shingled is None:
+            return None
+
+        shingles, key_terms = shingled
+        signature = make_signature(shingles)
+        best, best_value, best_similarity = None, None, self.threshold
+        refused = False
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(namespace, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            for entry_id in candidates:
+                _, entry_shingles, entry_terms, value = self._entries[entry_id]
+                similarity = jaccard(shingles, entry_shingles)
+                if similarity < best_similarity:
+                    continue
+                if entry_terms != key_terms:
+                    refused = True
+                    continue
+                best, best_value, best_similarity = entry_id, value, similarity
+            if best is not None:
+                self._entries.move_to_end(best)
+
+        record_similarity(
+            "similarity_cache_lookups_total",
+            "Near-duplicate answer lookups",
+            "hit" if best is not None else "refused" if refused else "miss",
+        )
+        return best_value
+
+    def add(self, namespace: str, text: str, value: dict):
+        if not self.enabled:
+            return
+        shingled = self._shingle(text)
+        if shingled is None:
+            return
+
+        shingles, key_terms = shingled
+        band_keys = self._band_keys(namespace, make_signature(shingles))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (band_keys, shingles, key_terms, value)
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                old_id, (old_keys, _, _, _) = self._entries.popitem(last=False)
+                for band_key in old_keys:
+                    bucket = self._buckets[band_key]
+                    bucket.discard(old_id)
+                    if not bucket:
+                        del self._buckets[band_key]
+
+    def record_shadow(self, agreed: bool):
+        record_similarity(
+            "similarity_cache_shadow_total",
+            "Near-duplicate matches compared with the model's grade",
+            "agree" if agreed else "disagree",
+        )
+
+
+_similarity_cache = None
+_similarity_cache_lock = threading.Lock()
+
+
+def get_similarity_cache() -> SimilarityCache:
+    global _similarity_cache
+    if _similarity_cache is None:
+        with _similarity_cache_lock:
+            if _similarity_cache is None:
+                _similarity_cache = SimilarityCache()
+    return _similarity_cache
+
+
+get_metrics().register_callback(
+    "similarity_cache_entries",
+    "gauge",
+    "Graded answers held by the near-duplicate cache",
+    lambda: len(get_similarity_cache()),
+)
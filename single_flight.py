@@ -0,0 +1,151 @@
+from grading_cache import SQLiteCache
+from llm_scheduler import LLM_CALL_DEADLINE
+from metrics import get_metrics
+from concurrent.futures import Future
+
+import os, threading, time, uuid
+
+# Identical model calls that are in flight at the same time share one call.
+# Within a process callers wait on the first caller's future; with
+# SINGLE_FLIGHT_PATH set, gunicorn workers also coordinate through a local
+# SQLite file, where the first worker claims the key and publishes its result.
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "on") == "on"
+SINGLE_FLIGHT_PATH = os.getenv("SINGLE_FLIGHT_PATH")
+# How long another worker's claim is honoured, and how long to wait on it
+SINGLE_FLIGHT_LEASE = float(os.getenv("SINGLE_FLIGHT_LEASE", str(LLM_CALL_DEADLINE + 5)))
+# Published results only need to outlive the waiters' polling
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "30"))
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+
+def record_single_flight(endpoint: str, outcome: str) -> None:
+    get_metrics().inc(
+        "llm_single_flight_total",
+        "Model calls by whether they were coalesced with an identical call",
+        endpoint=endpoint or "unknown",
+        outcome=outcome,
+    )
+
+
+class SQLiteFlights(SQLiteCache):
+    # Claims live in their own table next to the published results
+    def __init__(self, path: str, lease: float, result_ttl: float):
+        super().__init__(path, result_ttl, table="single_flight_results")
+        self.lease = lease
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS single_flight_claims "
+            "(key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def claim(self, key: str, owner: str) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("DELETE FROM single_flight_claims WHERE key = ? AND expires <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO single_flight_claims (key, owner, expires) VALUES (?, ?, ?)",
+            (key, owner, now + self.lease),
+        )
+        return cursor.rowcount == 1
+
+    def is_claimed(self, key: str) -> bool:
+        cursor = self._connect().execute(
+            "SELECT 1 FROM single_flight_claims WHERE key = ? AND expires > ?", (key, time.time())
+        )
+        return cursor.fetchone() is not None
+
+    def release(self, key: str, owner: str, value: dict = None):
+        if value is not None:
+            self.set(key, value)
+        self._connect().execute(
+            "DELETE FROM single_flight_claims WHERE key = ? AND owner = ?", (key, owner)
+        )
+
+    def wait(self, key: str, timeout: float):
+        # The published result, or None once the claim is gone without one
+        # (the owner failed) or the wait runs out
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = self.get(key)
+            if value is not None:
+                return value
+            if not self.is_claimed(key):
+                return self.get(key)
+            time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        return None
+
+
+class SingleFlight:
+    # run() returns (result, shared), where shared is True when the result
+    # came from someone else's call. `encode`/`decode` turn results into JSON
+    # for the cross-process table.
+    def __init__(
+        self,
+        path: str = SINGLE_FLIGHT_PATH,
+        lease: float = SINGLE_FLIGHT_LEASE,
+        result_ttl: float = SINGLE_FLIGHT_RESULT_TTL,
+    ):
+        self.flights = SQLiteFlights(path, lease, result_ttl) if path else None
+        self.lease = lease
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str):
+        # The in-flight future for `key`, and whether this caller must run it
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: str, fn, encode=None, decode=None):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result, shared = self._run_leader(key, fn, encode, decode)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, shared
+
+    def _run_leader(self, key, fn, encode, decode):
+        if self.flights is None:
+            return fn(), False
+
+        owner = uuid.uuid4().hex
+        if not self.flights.claim(key, owner):
+            value = self.flights.wait(key, self.lease)
+            if value is not None:
+                return decode(value), True
+        try:
+            result = fn()
+        except BaseException:
+            self.flights.release(key, owner)
+            raise
+        self.flights.release(key, owner, encode(result))
+        return result, False
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,38 @@
+import sys, types
+
+import pytest
+import tiktoken
+
+# config.py holds deployment settings and is not checked in. The tests never
+# reach the API, so an empty module stands in for it when it is missing.
+try:
+    import config
+except ImportError:
+    sys.modules["config"] = types.ModuleType("config")
+
+import token_utils
+
+# tiktoken downloads its BPE tables on first use. Without network access a
+# byte-level encoding stands in: one token per UTF-8 byte, so token counts only
+# ever come out high and budget checks still hold.
+try:
+    token_utils._get_encoding_by_name(token_utils.FALLBACK_ENCODING)
+except Exception:
+    _byte_encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\s+|\S+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    token_utils._get_encoding_by_name = lambda name: _byte_encoding
+    token_utils.get_encoding.cache_clear()
+
+
+@pytest.fixture
+def llm_backend():
+    # Swaps the process-wide model backend for the test and restores it after
+    from openai_utils import get_llm_backend, set_llm_backend
+
+    previous = get_llm_backend()
+    yield set_llm_backend
+    set_llm_backend(previous)
@@ -0,0 +1,86 @@
+import threading, time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition never became true"
+        time.sleep(0.01)
+
+
+def test_admits_within_budget():
+    controller = AdmissionController(global_budget=10, client_budget=10)
+    admission = controller.acquire("a", 6)
+    assert admission.queue_wait == 0.0
+    assert controller.in_flight == 6
+    controller.release(admission)
+    assert controller.in_flight == 0
+    assert controller.by_client == {}
+
+
+def test_rejects_a_client_over_its_budget():
+    controller = AdmissionController(global_budget=100, client_budget=10)
+    controller.acquire("a", 8)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("a", 5)
+    assert rejected.value.outcome == "rejected_client"
+    # Other clients are unaffected
+    controller.acquire("b", 5)
+
+
+def test_rejects_when_the_queue_is_full():
+    controller = AdmissionController(global_budget=10, client_budget=10, max_queue=0)
+    controller.acquire("a", 10)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("b", 1)
+    assert rejected.value.outcome == "rejected_queue_full"
+
+
+def test_queued_requests_time_out():
+    controller = AdmissionController(global_budget=10, client_budget=10, queue_timeout=0.05)
+    controller.acquire("a", 10)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("b", 1)
+    assert rejected.value.outcome == "rejected_timeout"
+    assert controller.queue_depth == 0
+    assert "b" not in controller.by_client
+
+
+def test_queued_requests_are_admitted_in_order():
+    controller = AdmissionController(global_budget=10, client_budget=10, queue_timeout=5)
+    first = controller.acquire("a", 8)
+    admitted = []
+
+    def acquire(client, cost):
+        controller.acquire(client, cost)
+        admitted.append(client)
+
+    # "c" would fit next to "a" on its own, but must not overtake "b"
+    big = threading.Thread(target=acquire, args=("b", 5))
+    big.start()
+    wait_for(lambda: controller.queue_depth == 1)
+    small = threading.Thread(target=acquire, args=("c", 1))
+    small.start()
+    wait_for(lambda: controller.queue_depth == 2)
+    time.sleep(0.05)
+    assert admitted == []
+
+    controller.release(first)
+    big.join()
+    small.join()
+    assert admitted == ["b", "c"]
+
+
+def test_client_id_ignores_forwarded_for():
+    from app import app, get_client_id
+
+    environ = {"REMOTE_ADDR": "203.0.113.7"}
+    headers = {"X-Forwarded-For": "198.51.100.1"}
+    with app.test_request_context(headers=headers, environ_base=environ):
+        assert get_client_id() == "203.0.113.7"
+    with app.test_request_context(headers={"Fly-Client-IP": "192.0.2.9", **headers}):
+        assert get_client_id() == "192.0.2.9"
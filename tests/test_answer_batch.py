@@ -0,0 +1,54 @@
+import pytest
+
+import grading_cache
+from asylum_check import (
+    AnswerReason,
+    FormQuestion,
+    batch_cache_key,
+    evaluation_cache_key,
+    lookup_cached_answers,
+    lookup_evaluation,
+    store_answer_batch,
+)
+from grading_cache import GradingCache
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = GradingCache(path=None)
+    monkeypatch.setattr(grading_cache, "_grading_cache", cache)
+    return cache
+
+
+def make_question(answer: str) -> FormQuestion:
+    return FormQuestion("Why did you have to leave the country?", [], answer, None, False)
+
+
+def make_result(reasoning: str):
+    return AnswerReason(
+        rule_violation=False,
+        missing_info=False,
+        said_too_much=False,
+        irrelevant_info=False,
+        reasoning=reasoning,
+    )
+
+
+def test_batch_grades_have_their_own_cache_slot():
+    question = make_question("The police arrested me twice for my political opinion.")
+    assert batch_cache_key(question) != evaluation_cache_key(question)
+
+    store_answer_batch([question], [(make_result("batch"), 0, 0, None)])
+    assert lookup_evaluation(evaluation_cache_key(question)) is None
+    assert lookup_evaluation(batch_cache_key(question))[0].reasoning == "batch"
+
+
+def test_batch_lookup_ignores_single_question_grades(cache):
+    graded = make_question("The police arrested me twice for my political opinion.")
+    fresh = make_question("Soldiers burned our village because we are Christian.")
+    cache.set(evaluation_cache_key(graded), make_result("single").model_dump())
+    cache.set(batch_cache_key(fresh), make_result("batch").model_dump())
+
+    results, misses = lookup_cached_answers([graded, fresh])
+    assert misses == [0]
+    assert results[1][0].reasoning == "batch"
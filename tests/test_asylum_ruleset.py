@@ -0,0 +1,40 @@
+import asylum_ruleset
+from asylum_check import FormQuestion, evaluation_cache_key, similarity_namespace
+from asylum_ruleset import Rule, SHORT_ANSWER_RULES, hash_rules, make_rule_set
+
+
+def make_question(specific_rules: list[str]) -> FormQuestion:
+    return FormQuestion(
+        "Why did you have to leave the country?", specific_rules, "I was threatened.", None, False
+    )
+
+
+def test_rule_set_hash_follows_rule_text():
+    rules = list(SHORT_ANSWER_RULES.rules)
+    edited = rules[:-1] + [Rule(rules[-1].id, rules[-1].text + " Be brief.")]
+
+    assert hash_rules(rules) == SHORT_ANSWER_RULES.hash
+    assert hash_rules(edited) != SHORT_ANSWER_RULES.hash
+
+
+def test_version_bump_changes_rule_set_hash(monkeypatch):
+    rule_ids = [rule.id for rule in SHORT_ANSWER_RULES.rules]
+    before = make_rule_set("short", rule_ids).hash
+
+    monkeypatch.setattr(asylum_ruleset, "RULESET_VERSION", "next")
+
+    assert make_rule_set("short", rule_ids).hash != before
+
+
+def test_cache_keys_change_with_the_rules(monkeypatch):
+    question = make_question(["Say where you were threatened."])
+    edited = make_question(["Say where and when you were threatened."])
+    key, namespace = evaluation_cache_key(question), similarity_namespace(question)
+
+    assert evaluation_cache_key(edited) != key
+    assert similarity_namespace(edited) != namespace
+
+    monkeypatch.setattr(asylum_ruleset, "RULESET_VERSION", "next")
+
+    assert evaluation_cache_key(question) != key
+    assert similarity_namespace(question) != namespace
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from asylum_check import AnswerReason, make_question_from_json
+from bulk_grade import BulkGrader, LocalBatchEndpoint, make_batch_request
+from llm_backends import FakeBackend
+
+FORMS = [
+    {
+        "form_id": f"form-{i}",
+        "questions": [
+            {"question": "Why did you leave?", "specific_rules": [], "answer": f"Answer {i}.{j}"}
+            for j in range(2)
+        ],
+    }
+    for i in range(3)
+]
+GOOD = AnswerReason(
+    rule_violation=False,
+    missing_info=False,
+    said_too_much=False,
+    irrelevant_info=False,
+    reasoning="Fine.",
+)
+
+
+def completion(reason: AnswerReason) -> dict:
+    return {"choices": [{"message": {"content": reason.model_dump_json(), "refusal": None}}]}
+
+
+def grade_all(body: dict) -> dict:
+    return completion(GOOD)
+
+
+def failing_on(answer: str):
+    def handler(body: dict) -> dict:
+        if answer in body["messages"][-1]["content"]:
+            raise RuntimeError("server_error")
+        return completion(GOOD)
+
+    return handler
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text("".join(json.dumps(form) + "\n" for form in FORMS))
+    return str(path)
+
+
+def run(tmp_path, corpus, handler, **kwargs) -> list[dict]:
+    endpoint = LocalBatchEndpoint(str(tmp_path / "batches"), handler)
+    grader = BulkGrader(endpoint, str(tmp_path / "out"), chunk_size=2, poll_interval=0.01, **kwargs)
+    grader.run(corpus)
+    grader.merge(str(tmp_path / "graded.jsonl"))
+    with open(tmp_path / "graded.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_grades_every_form_in_order(tmp_path, corpus):
+    graded = run(tmp_path, corpus, grade_all)
+    assert [form["form_id"] for form in graded] == ["form-0", "form-1", "form-2"]
+    for form in graded:
+        assert form["errors"] == {}
+        assert all(q["evaluation"]["reasoning"] == "Fine." for q in form["feedback"])
+
+
+def test_failed_lines_are_graded_synchronously(tmp_path, corpus, llm_backend):
+    llm_backend(FakeBackend(latency_median=0, responder=lambda request, format: GOOD))
+    graded = run(tmp_path, corpus, failing_on("Answer 1.1"))
+    assert graded[1]["errors"] == {}
+    assert graded[1]["feedback"][1]["evaluation"]["reasoning"] == "Fine."
+
+
+def test_failed_lines_are_reported_without_the_fallback(tmp_path, corpus):
+    graded = run(tmp_path, corpus, failing_on("Answer 1.1"), sync_fallback=False)
+    assert list(graded[1]["errors"]) == ["1"]
+    assert "server_error" in graded[1]["errors"]["1"]
+    assert graded[1]["feedback"][1]["evaluation"] is None
+    assert graded[0]["errors"] == {} and graded[2]["errors"] == {}
+
+
+def test_resumes_from_the_checkpoint(tmp_path, corpus):
+    run(tmp_path, corpus, grade_all)
+
+    def unreachable(body: dict) -> dict:
+        raise AssertionError("a finished chunk was graded again")
+
+    assert len(run(tmp_path, corpus, unreachable)) == 3
+
+
+def test_requests_use_a_strict_json_schema():
+    request = make_batch_request("form/0", make_question_from_json(FORMS[0]["questions"][0]))
+    response_format = request["body"]["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
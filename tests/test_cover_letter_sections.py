@@ -0,0 +1,62 @@
+from asylum_check import (
+    COVER_LETTER_SECTION_QUESTION,
+    CoverLetter,
+    make_letter_section_questions,
+    split_letter_sections,
+)
+from token_utils import count_tokens
+
+STORY = " ".join(
+    f"On day {i} the police came to my house and beat me because of my religion." for i in range(40)
+)
+LETTER = (
+    "Dear Asylum Officer,\n\n"
+    "BACKGROUND\nI was born in the capital. I studied law at the national university.\n\n"
+    f"PERSECUTION\n{STORY}\n\n"
+    "Thank you for considering my application."
+)
+
+
+def test_sections_cover_the_letter_in_order():
+    sections = split_letter_sections(LETTER, budget=100)
+    for section in sections:
+        assert section.text == LETTER[section.start : section.end]
+    for before, after in zip(sections, sections[1:]):
+        assert before.end <= after.start
+        assert not LETTER[before.end : after.start].strip()
+    assert LETTER[: sections[0].start].strip() == ""
+    assert LETTER[sections[-1].end :].strip() == ""
+
+
+def test_headings_start_sections():
+    sections = split_letter_sections(LETTER, budget=100)
+    assert sections[0].heading is None
+    assert sections[1].heading == "BACKGROUND"
+    assert sections[1].text.startswith("BACKGROUND")
+    assert sections[2].heading == "PERSECUTION"
+
+
+def test_long_paragraphs_are_split_at_sentences_under_budget():
+    sections = split_letter_sections(LETTER, budget=100)
+    story = [section for section in sections if section.heading == "PERSECUTION"]
+    assert len(story) > 1
+    for section in story:
+        assert count_tokens(section.text) <= 100
+        assert section.text.rstrip().endswith(".")
+    # Continuations keep the heading of the section they continue
+    assert story[-1].location(len(sections) - 1).endswith("(PERSECUTION)")
+
+
+def test_short_letters_are_one_section():
+    sections = split_letter_sections("I fear the police.\n\nThey arrested me twice.", budget=500)
+    assert len(sections) == 1
+    assert sections[0].heading is None
+
+
+def test_one_question_per_section_plus_the_whole_letter():
+    letter = CoverLetter(LETTER, [], None, False)
+    sections = split_letter_sections(LETTER, budget=100)
+    questions = make_letter_section_questions(letter, sections)
+    assert len(questions) == len(sections) + 1
+    assert all(q.question == COVER_LETTER_SECTION_QUESTION for q in questions[:-1])
+    assert questions[-1].answer == LETTER
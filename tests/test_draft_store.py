@@ -0,0 +1,80 @@
+from collections import Counter
+
+import pytest
+
+import draft_store
+import grading_cache
+from asylum_check import AnswerReason, FormQuestion, check_answers_and_give_feedback
+from draft_store import DraftStore
+from grading_cache import GradingCache
+from llm_backends import FakeBackend
+
+GOOD = AnswerReason(
+    rule_violation=False,
+    missing_info=False,
+    said_too_much=False,
+    irrelevant_info=False,
+    reasoning="Fine.",
+)
+
+
+@pytest.fixture
+def calls(monkeypatch, llm_backend):
+    # No grading cache, so every grade that is not restored reaches the model.
+    # Counts model calls per graded answer; routing may sample an answer twice.
+    monkeypatch.setattr(grading_cache, "_grading_cache", GradingCache(max_size=0))
+    monkeypatch.setattr(draft_store, "_draft_store", DraftStore(path=None))
+    calls = Counter()
+
+    def respond(request, format):
+        calls[request["messages"][-1]["content"].split("Answer: ")[-1].strip()] += 1
+        return GOOD
+
+    llm_backend(FakeBackend(latency_median=0, responder=respond))
+    return calls
+
+
+def make_form(*answers: str) -> list[FormQuestion]:
+    return [
+        FormQuestion(f"Question {i}: who threatened you?", [], answer, None, False)
+        for i, answer in enumerate(answers)
+    ]
+
+
+def test_store_round_trips_through_sqlite(tmp_path):
+    path = str(tmp_path / "drafts.db")
+    DraftStore(path=path).set("form", {"0:q": {"answer": "a"}})
+
+    assert DraftStore(path=path).get("form") == {"0:q": {"answer": "a"}}
+
+
+def test_disabled_store_keeps_nothing():
+    store = DraftStore(max_size=0, path=None)
+    store.set("form", {"0:q": {}})
+
+    assert store.get("form") == {}
+    assert DraftStore(path=None).get(None) == {}
+
+
+def test_resubmission_only_regrades_changed_answers(calls):
+    first = ["Soldiers from the army came to my house.", "The police refused to help me."]
+    check_answers_and_give_feedback(make_form(*first), "form")
+    graded = calls.copy()
+
+    feedback = check_answers_and_give_feedback(
+        make_form(first[0], "The police arrested my brother."), "form"
+    )
+
+    assert calls - graded == Counter({"The police arrested my brother.": graded[first[1]]})
+    assert [item["evaluation"]["reasoning"] for item in feedback] == ["Fine.", "Fine."]
+
+
+def test_drafts_are_kept_per_form(calls):
+    answers = ["Soldiers from the army came to my house."]
+    check_answers_and_give_feedback(make_form(*answers), "form-a")
+    graded = calls[answers[0]]
+    check_answers_and_give_feedback(make_form(*answers), "form-b")
+    check_answers_and_give_feedback(make_form(*answers), "form-a")
+
+    assert graded > 0
+    assert calls[answers[0]] == 2 * graded
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import draft_store
+import grading_cache
+from asylum_check import AnswerReason, FormQuestion, iter_checked_drafts
+from draft_store import DraftStore
+from grading_cache import GradingCache
+from llm_backends import FakeBackend
+
+GOOD = AnswerReason(
+    rule_violation=False,
+    missing_info=False,
+    said_too_much=False,
+    irrelevant_info=False,
+    reasoning="Fine.",
+)
+QUESTIONS = [
+    {"question": f"Question {i}: who threatened you?", "specific_rules": [], "answer": answer}
+    for i, answer in enumerate(
+        ["Soldiers from the army came to my house.", "The police refused to help me."]
+    )
+]
+
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch, llm_backend):
+    monkeypatch.setattr(grading_cache, "_grading_cache", GradingCache(max_size=0))
+    monkeypatch.setattr(draft_store, "_draft_store", DraftStore(path=None))
+    llm_backend(FakeBackend(latency_median=0, responder=lambda request, format: GOOD))
+
+
+def make_form(answers: list[str]) -> list[FormQuestion]:
+    return [
+        FormQuestion(q["question"], [], answer, None, False)
+        for q, answer in zip(QUESTIONS, answers)
+    ]
+
+
+def test_unchanged_drafts_are_yielded_first_and_free():
+    answers = [q["answer"] for q in QUESTIONS]
+    list(iter_checked_drafts(make_form(answers), "form"))
+
+    questions = make_form([answers[0], "The police arrested my brother."])
+    checked = list(iter_checked_drafts(questions, "form"))
+
+    assert checked[0] == (0, 0, 0)
+    assert [i for i, _, _ in checked] == [0, 1]
+    assert checked[1][1] > 0
+    assert all(q.answer_evaluation is not None for q in questions)
+
+
+def test_stream_emits_one_record_per_question_then_a_summary(tmp_path, monkeypatch):
+    import job_queue
+    from app import app
+
+    monkeypatch.setattr(job_queue, "_job_queue", job_queue.JobQueue(str(tmp_path / "jobs.sqlite3")))
+
+    response = app.test_client().post("/gradequestions/stream", json={"questions": QUESTIONS})
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(True).splitlines()]
+    assert sorted(record["index"] for record in records[:-1]) == [0, 1]
+    assert all(record["evaluation"]["reasoning"] == "Fine." for record in records[:-1])
+    summary = records[-1]["summary"]
+    assert (summary["questions"], summary["finalized"]) == (2, 2)
+    assert summary["usage"]["llm_calls"] > 0
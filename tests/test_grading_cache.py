@@ -0,0 +1,60 @@
+import time
+
+from grading_cache import GradingCache, MemoryCache, make_cache_key
+
+KEY_ARGS = ("Why did you leave?", "They threatened me.", "rules", "gpt-4o", 0.1, "{}")
+
+
+def test_cache_key_covers_every_input():
+    key = make_cache_key(*KEY_ARGS)
+
+    assert make_cache_key(*KEY_ARGS) == key
+    for i in range(len(KEY_ARGS)):
+        changed = list(KEY_ARGS)
+        changed[i] = "other" if isinstance(changed[i], str) else 0.7
+        assert make_cache_key(*changed) != key
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_size=2, ttl=60)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.get("a")
+    cache.set("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_entries(monkeypatch):
+    cache = MemoryCache(max_size=2, ttl=60)
+    cache.set("a", {"v": 1})
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_grading_cache_counts_hits_and_misses():
+    cache = GradingCache(path=None)
+    cache.get("a")
+    cache.set("a", {"v": 1})
+
+    assert cache.get("a") == {"v": 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_workers_share_grades_through_sqlite(tmp_path):
+    path = str(tmp_path / "grades.db")
+    GradingCache(path=path).set("a", {"v": 1})
+
+    assert GradingCache(path=path).get("a") == {"v": 1}
+
+
+def test_disabled_cache_stores_nothing():
+    cache = GradingCache(max_size=0, path=None)
+    cache.set("a", {"v": 1})
+
+    assert cache.get("a") is None
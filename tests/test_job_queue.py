@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, JobQueueFull
+
+
+@pytest.fixture
+def queue(tmp_path):
+    # Workers are never started; tests claim and run jobs by hand
+    queue = JobQueue(
+        path=str(tmp_path / "jobs.sqlite3"), lanes={"questions": 1}, lease=0.05, max_attempts=2
+    )
+    queue.register("echo", "questions", lambda payload: payload["value"])
+    return queue
+
+
+def test_runs_a_claimed_job(queue):
+    job_id = queue.submit("echo", {"value": 42})
+    assert queue.get(job_id)["status"] == "queued"
+
+    row = queue.claim("questions")
+    assert row["id"] == job_id
+    assert queue.get(job_id)["status"] == "running"
+
+    queue.run_job(row)
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == 42
+
+
+def test_expired_lease_is_claimed_again(queue):
+    job_id = queue.submit("echo", {"value": 1})
+    assert queue.claim("questions")["id"] == job_id
+    # The worker holding the lease dies without finishing
+    assert queue.claim("questions") is None
+
+    time.sleep(0.1)
+    row = queue.claim("questions")
+    assert row["id"] == job_id
+    assert queue.get(job_id)["attempts"] == 2
+
+
+def test_job_that_keeps_losing_its_lease_fails(queue):
+    job_id = queue.submit("echo", {"value": 1})
+    for _ in range(2):
+        assert queue.claim("questions")["id"] == job_id
+        time.sleep(0.1)
+
+    assert queue.claim("questions") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Job did not finish"
+
+
+def test_failed_handler_is_retried_then_fails(queue):
+    queue.register("broken", "questions", lambda payload: payload["missing"])
+    job_id = queue.submit("broken", {})
+
+    queue.run_job(queue.claim("questions"))
+    assert queue.get(job_id)["status"] == "queued"
+
+    queue.run_job(queue.claim("questions"))
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"].startswith("KeyError")
+
+
+def test_rejects_clients_with_too_many_pending_jobs(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_QUEUED_PER_CLIENT", 2)
+    queue.submit("echo", {"value": 1}, client="a")
+    queue.submit("echo", {"value": 2}, client="a")
+    with pytest.raises(JobQueueFull):
+        queue.submit("echo", {"value": 3}, client="a")
+    queue.submit("echo", {"value": 4}, client="b")
+
+
+def test_queued_jobs_report_their_position(queue):
+    first = queue.submit("echo", {"value": 1})
+    second = queue.submit("echo", {"value": 2})
+    assert queue.get(first)["position"] == 0
+    assert queue.get(second)["position"] == 1
+
+
+def test_long_poll_returns_when_the_job_finishes(queue):
+    job_id = queue.submit("echo", {"value": 7})
+    queue.run_job(queue.claim("questions"))
+    assert queue.wait(job_id, 5)["status"] == "done"
+
+
+def test_long_polls_past_the_limit_return_at_once(queue):
+    job_id = queue.submit("echo", {"value": 7})
+    while queue._long_polls.acquire(blocking=False):
+        pass
+
+    start = time.monotonic()
+    assert queue.wait(job_id, 5)["status"] == "queued"
+    assert time.monotonic() - start < 1
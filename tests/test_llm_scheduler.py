@@ -0,0 +1,168 @@
+import threading, time
+
+import pytest
+
+import llm_scheduler
+from llm_backends import SimulatedRateLimitError
+from llm_scheduler import CircuitBreaker, CircuitOpenError, RateLimitScheduler, TokenBucket
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "LLM_BACKOFF_BASE", 0.001)
+
+
+def failing(errors, result="ok"):
+    # A request that raises each of `errors` in turn, then returns `result`
+    calls = []
+
+    def request(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return request, calls
+
+
+def test_retries_transient_errors():
+    request, calls = failing([ServerError(), ServerError()])
+    assert RateLimitScheduler().run(request, 100) == "ok"
+    assert len(calls) == 3
+
+
+def test_does_not_retry_client_errors():
+    request, calls = failing([BadRequest()])
+    with pytest.raises(BadRequest):
+        RateLimitScheduler().run(request, 100)
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    request, calls = failing([ServerError()] * 10)
+    with pytest.raises(ServerError):
+        RateLimitScheduler(max_retries=2).run(request, 100)
+    assert len(calls) == 3
+
+
+def test_breaker_opens_after_consecutive_failures():
+    scheduler = RateLimitScheduler(max_retries=0)
+    for _ in range(scheduler.breaker.threshold):
+        request, _ = failing([ServerError()])
+        with pytest.raises(ServerError):
+            scheduler.run(request, 100)
+
+    request, calls = failing([])
+    with pytest.raises(CircuitOpenError):
+        scheduler.run(request, 100)
+    assert calls == []
+
+
+def test_success_closes_the_breaker():
+    scheduler = RateLimitScheduler(max_retries=0)
+    for _ in range(scheduler.breaker.threshold - 1):
+        request, _ = failing([ServerError()])
+        with pytest.raises(ServerError):
+            scheduler.run(request, 100)
+    request, _ = failing([])
+    scheduler.run(request, 100)
+    assert scheduler.breaker.failures == 0
+    assert scheduler.breaker.state == "closed"
+
+
+def allowed_elsewhere(breaker: CircuitBreaker) -> bool:
+    result = []
+    thread = threading.Thread(target=lambda: result.append(breaker.allow()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    # The probe's own retries are let through, nobody else's calls are
+    assert breaker.allow()
+    assert not allowed_elsewhere(breaker)
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert allowed_elsewhere(breaker)
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not allowed_elsewhere(breaker)
+
+
+def test_inconclusive_probe_hands_over_to_the_next_caller():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.release()
+    assert allowed_elsewhere(breaker)
+
+
+def test_scheduler_releases_a_rate_limited_probe():
+    scheduler = RateLimitScheduler(max_retries=0)
+    scheduler.breaker = half_open_breaker()
+    request, _ = failing([SimulatedRateLimitError(0.0)])
+    with pytest.raises(SimulatedRateLimitError):
+        scheduler.run(request, 100)
+    assert allowed_elsewhere(scheduler.breaker)
+
+
+def test_rate_limits_do_not_open_the_breaker():
+    scheduler = RateLimitScheduler(max_retries=0)
+    for _ in range(scheduler.breaker.threshold * 2):
+        request, _ = failing([SimulatedRateLimitError(0.0)])
+        with pytest.raises(SimulatedRateLimitError):
+            scheduler.run(request, 100)
+    assert scheduler.breaker.state == "closed"
+
+
+def test_backoff_honours_retry_after_and_drains_buckets():
+    scheduler = RateLimitScheduler(requests_per_minute=600, tokens_per_minute=60000)
+    assert scheduler.backoff(0, SimulatedRateLimitError(2.5)) >= 2.5
+    assert scheduler.requests.level <= 0
+    assert scheduler.tokens.level <= 0
+
+
+def test_token_bucket_reservations_queue_up():
+    bucket = TokenBucket(per_minute=60, capacity=1)
+    assert bucket.reserve(1) == 0.0
+    # One token a second, so the next two callers wait about one and two seconds
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve(1) == pytest.approx(2.0, abs=0.05)
+
+
+def test_token_bucket_without_a_rate_never_waits():
+    bucket = TokenBucket()
+    assert bucket.reserve(10**9) == 0.0
+
+
+def test_refuses_calls_the_budget_cannot_fit_before_the_deadline():
+    scheduler = RateLimitScheduler(tokens_per_minute=60)
+    request, calls = failing([])
+    with pytest.raises(TimeoutError):
+        scheduler.run(request, 1000, timeout=1.0)
+    assert calls == []
@@ -0,0 +1,69 @@
+from metrics import (
+    MetricsRegistry,
+    get_request_usage,
+    record_llm_call,
+    start_request_usage,
+)
+
+
+def test_renders_counters_with_labels():
+    registry = MetricsRegistry()
+    registry.inc("jobs_total", "Jobs", lane="questions")
+    registry.inc("jobs_total", "Jobs", 2, lane="questions")
+    registry.inc("jobs_total", "Jobs", lane='say "hi"')
+    text = registry.render()
+    assert "# HELP jobs_total Jobs\n# TYPE jobs_total counter\n" in text
+    assert 'jobs_total{lane="questions"} 3.0\n' in text
+    assert 'jobs_total{lane="say \\"hi\\""} 1.0\n' in text
+
+
+def test_renders_cumulative_histogram_buckets():
+    registry = MetricsRegistry()
+    for value in (0.003, 0.2, 0.2, 500):
+        registry.observe("latency_seconds", "Latency", value, route="/x")
+    lines = registry.render().splitlines()
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/x",le="0.005"} 1' in lines
+    assert 'latency_seconds_bucket{route="/x",le="0.25"} 3' in lines
+    assert 'latency_seconds_bucket{route="/x",le="120"} 3' in lines
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/x"} 4' in lines
+
+
+def test_callbacks_are_read_at_scrape_time():
+    registry = MetricsRegistry()
+    depth = [1]
+    registry.register_callback("queue_depth", "gauge", "Depth", lambda: depth[0])
+    depth[0] = 5
+    assert "queue_depth 5.0\n" in registry.render()
+
+
+def test_llm_calls_are_added_to_the_request_usage():
+    usage = start_request_usage("/gradequestions")
+    record_llm_call("check_answer", "gpt-4o", 100, 40, 20, 0.5, 1.0, 0.1)
+    record_llm_call("check_answer", "gpt-4o", 50, 0, 10, 0.0, 0.5, 0.1)
+    assert get_request_usage() is usage
+    assert usage.to_dict() == {
+        "llm_calls": 2,
+        "tokens_in": 150,
+        "cached_tokens_in": 40,
+        "tokens_out": 30,
+        "queue_wait": 0.5,
+        "network_latency": 1.5,
+        "parse_time": 0.2,
+    }
+
+
+def test_metrics_endpoint_reports_requests(tmp_path, monkeypatch):
+    import job_queue
+    from app import app
+
+    # The queue-depth gauge would otherwise open jobs.sqlite3 in the working directory
+    monkeypatch.setattr(job_queue, "_job_queue", job_queue.JobQueue(str(tmp_path / "jobs.sqlite3")))
+
+    client = app.test_client()
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.get_data(True)
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from llm_backends import FakeBackend, make_fake_instance
+from model_routing import RoutingPolicy, call_routed
+from openai_utils import call_gpt_formatted, make_message
+from pydantic import BaseModel
+from single_flight import SINGLE_FLIGHT
+
+
+class Verdict(BaseModel):
+    flagged: bool
+
+
+class CountingBackend(FakeBackend):
+    # Answers alternate between flagged and not flagged, so two independent
+    # samples always disagree
+    def __init__(self):
+        super().__init__(latency_median=0.05, latency_sigma=0.0, responder=self.respond)
+        self.models = []
+        self._count_lock = threading.Lock()
+
+    def respond(self, request, format):
+        with self._count_lock:
+            self.models.append(request["model"])
+            flagged = len(self.models) % 2 == 0
+        if format is Verdict:
+            return Verdict(flagged=flagged)
+        return make_fake_instance(format)
+
+
+MESSAGES = [make_message("system", "Grade this."), make_message("user", "An answer")]
+
+
+def test_routing_samples_are_not_coalesced(llm_backend):
+    backend = CountingBackend()
+    llm_backend(backend)
+    policy = RoutingPolicy("tiered", small_model="small", large_model="large", samples=2)
+
+    response, _, _, _ = call_routed(
+        MESSAGES,
+        Verdict,
+        "routing_test",
+        agreement_key=lambda verdict: verdict.flagged,
+        policy=policy,
+    )
+
+    # Both small-model samples reached the model, disagreed, and escalated
+    assert sorted(backend.models) == ["large", "small", "small"]
+    assert response is not None
+
+
+@pytest.mark.skipif(not SINGLE_FLIGHT, reason="SINGLE_FLIGHT is off")
+def test_identical_concurrent_calls_are_coalesced(llm_backend):
+    backend = CountingBackend()
+    llm_backend(backend)
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(call_gpt_formatted(MESSAGES, Verdict, model="small"))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.models == ["small"]
+    assert results[0][0] == results[1][0]
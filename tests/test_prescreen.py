@@ -0,0 +1,74 @@
+from asylum_check import FormQuestion
+from prescreen import (
+    PRESCREEN_HIGH_CONFIDENCE,
+    check_economic_only,
+    check_short_answer,
+    check_vague_perpetrators,
+    prescreen_answer,
+)
+
+FEAR_QUESTION = "Do you fear harm or mistreatment if you return to your home country?"
+EMPLOYMENT_QUESTION = "List your employment for the last five years."
+ASSETS_QUESTION = "Describe any money or property you own in your home country."
+
+
+def rule_ids(flags) -> list[str]:
+    return [flag.rule_id for flag in flags]
+
+
+def test_empty_answer_is_missing_info():
+    (flag,) = check_short_answer(FEAR_QUESTION, "  ")
+    assert flag.rule_id == "empty-answer"
+    assert flag.confidence >= PRESCREEN_HIGH_CONFIDENCE
+
+
+def test_short_answer_is_only_sent_for_a_second_look():
+    (flag,) = check_short_answer("Have you ever been arrested?", "No.")
+    assert flag.rule_id == "short-answer"
+    assert flag.confidence < PRESCREEN_HIGH_CONFIDENCE
+
+
+def test_short_answer_pointing_to_the_cover_letter_passes():
+    assert check_short_answer(FEAR_QUESTION, "See cover letter.") == []
+
+
+def test_economic_answer_to_a_fear_question_is_flagged():
+    answer = "I left because there were no jobs and no money to feed my family."
+    (flag,) = check_economic_only(FEAR_QUESTION, answer)
+    assert flag.rule_id == "economic-hardship"
+    assert flag.field == "rule_violation"
+
+
+def test_economic_harm_tied_to_persecution_passes():
+    answer = "I lost my job after the police arrested me for joining the opposition party."
+    assert check_economic_only(FEAR_QUESTION, answer) == []
+
+
+def test_employment_answers_are_not_economic_hardship():
+    answer = "I was employed as a teacher and earned a salary of 300 dollars a month."
+    assert check_economic_only(EMPLOYMENT_QUESTION, answer) == []
+    answer = "I do not have any money or property in my country."
+    assert check_economic_only(ASSETS_QUESTION, answer) == []
+
+
+def test_vague_perpetrators_are_flagged():
+    (flag,) = check_vague_perpetrators(FEAR_QUESTION, "They came to my house and beat me.")
+    assert flag.rule_id == "specify-perpetrators"
+    assert flag.confidence < PRESCREEN_HIGH_CONFIDENCE
+
+
+def test_named_perpetrators_pass():
+    answer = "Members of the ruling party came to my house and beat me."
+    assert check_vague_perpetrators(FEAR_QUESTION, answer) == []
+
+
+def test_prescreen_answer_stops_after_missing_info():
+    question = FormQuestion(FEAR_QUESTION, [], "", None, False)
+    assert rule_ids(prescreen_answer(question)) == ["empty-answer"]
+
+
+def test_prescreen_answer_uses_the_question():
+    answer = "I was employed as a teacher and earned a salary of 300 dollars a month."
+    assert prescreen_answer(FormQuestion(EMPLOYMENT_QUESTION, [], answer, None, False)) == []
+    flags = prescreen_answer(FormQuestion(FEAR_QUESTION, [], answer, None, False))
+    assert rule_ids(flags) == ["economic-hardship"]
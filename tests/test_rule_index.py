@@ -0,0 +1,38 @@
+from asylum_ruleset import SHORT_ANSWER_RULES
+from rule_index import RULE_SELECTION_CORE, select_rules, tokenize
+
+
+def rule_ids(rule_set) -> list[str]:
+    return [rule.id for rule in rule_set.rules]
+
+
+def test_tokenize_drops_stopwords_and_suffixes():
+    assert tokenize("I was persecuted") == tokenize("the persecution")
+
+
+def test_selection_is_off_by_default():
+    assert select_rules(SHORT_ANSWER_RULES, "They beat me", top_k=0) is SHORT_ANSWER_RULES
+
+
+def test_core_rules_lead_the_selection():
+    selected = select_rules(SHORT_ANSWER_RULES, "I could not find a job", top_k=2)
+
+    core = [rule_id for rule_id in RULE_SELECTION_CORE if rule_id in rule_ids(SHORT_ANSWER_RULES)]
+    assert rule_ids(selected)[: len(core)] == core
+    assert len(selected.rules) <= len(core) + 2
+
+
+def test_selection_follows_the_answer():
+    economic = select_rules(SHORT_ANSWER_RULES, "I lost my job and had no money", top_k=2)
+    evidence = select_rules(SHORT_ANSWER_RULES, "I have medical records and photos", top_k=2)
+
+    assert "economic-hardship" in rule_ids(economic)
+    assert "economic-hardship" not in rule_ids(evidence)
+    assert economic.hash != evidence.hash
+
+
+def test_equal_selections_share_one_rule_set():
+    first = select_rules(SHORT_ANSWER_RULES, "I lost my job", top_k=2)
+    second = select_rules(SHORT_ANSWER_RULES, "I lost my job", top_k=2)
+
+    assert first is second
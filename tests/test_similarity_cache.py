@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from similarity_cache import SimilarityCache, jaccard, make_shingles, normalize_answer
+
+with open("example_questions.json") as f:
+    ANSWER = json.load(f)[0]["answer"]
+GRADE = {"rule_violation": False, "missing_info": False}
+
+
+@pytest.fixture
+def cache():
+    cache = SimilarityCache(mode="on", threshold=0.9)
+    cache.add("q", ANSWER, GRADE)
+    return cache
+
+
+def test_serves_a_near_duplicate(cache):
+    retyped = ANSWER.replace("I had to leave", "i had to  LEAVE").replace(".", "!")
+    assert cache.lookup("q", retyped) == GRADE
+    edited = ANSWER.replace("seek safety and protection", "seek safety and real protection")
+    assert cache.lookup("q", edited) == GRADE
+
+
+def test_negated_answer_misses(cache):
+    negated = ANSWER.replace("I was being persecuted", "I was not being persecuted")
+    # Similar enough by shingles alone, so only the negation guard stops it
+    similarity = jaccard(
+        make_shingles(normalize_answer(ANSWER)), make_shingles(normalize_answer(negated))
+    )
+    assert similarity >= 0.9
+    assert cache.lookup("q", negated) is None
+
+
+def test_changed_rule_vocabulary_misses(cache):
+    changed = ANSWER.replace("by the government", "by the gangs")
+    assert cache.lookup("q", changed) is None
+
+
+def test_other_namespaces_miss(cache):
+    assert cache.lookup("other question", ANSWER) is None
+
+
+def test_short_answers_are_left_to_the_exact_cache():
+    cache = SimilarityCache(mode="on")
+    cache.add("q", "I fear the police.", GRADE)
+    assert cache.lookup("q", "I fear the police.") is None
+
+
+def test_evicts_least_recently_used():
+    cache = SimilarityCache(mode="on", max_size=1)
+    cache.add("q", ANSWER, GRADE)
+    cache.add("q", "A completely different answer about my family and our farm.", GRADE)
+    assert len(cache) == 1
+    assert cache.lookup("q", ANSWER) is None
+
+
+def test_off_mode_stores_nothing():
+    cache = SimilarityCache(mode="off")
+    cache.add("q", ANSWER, GRADE)
+    assert len(cache) == 0
+    assert cache.lookup("q", ANSWER) is None
@@ -0,0 +1,96 @@
+import threading, time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_together(count: int, fn):
+    # Starts `count` threads on fn at once and returns their results
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def target(i):
+        barrier.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow_call(calls: list, value="result", delay: float = 0.1):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return value
+
+    return fn
+
+
+def test_concurrent_identical_calls_share_one_call():
+    flight = SingleFlight(path=None)
+    calls = []
+    results = run_together(4, lambda: flight.run("key", slow_call(calls)))
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["result"] * 4
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight(path=None)
+    calls = []
+    run_together(2, lambda: flight.run(threading.current_thread().name, slow_call(calls)))
+    assert len(calls) == 2
+
+
+def test_leader_errors_reach_followers_and_release_the_key():
+    flight = SingleFlight(path=None)
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("model failed")
+
+    errors = []
+
+    def follower():
+        started.wait()
+        try:
+            flight.run("key", lambda: "unused")
+        except ValueError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    with pytest.raises(ValueError):
+        flight.run("key", failing)
+    thread.join()
+
+    assert len(errors) == 1
+    assert flight.run("key", lambda: "fresh") == ("fresh", False)
+
+
+def test_processes_coordinate_through_sqlite(tmp_path):
+    # Two instances stand in for two gunicorn workers sharing the file
+    path = str(tmp_path / "flights.sqlite3")
+    first, second = SingleFlight(path=path), SingleFlight(path=path)
+    calls = []
+    codec = {"encode": lambda value: {"value": value}, "decode": lambda value: value["value"]}
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(first.run("key", slow_call(calls, delay=0.3), **codec))
+    )
+    leader.start()
+    time.sleep(0.1)
+    results.append(second.run("key", slow_call(calls), **codec))
+    leader.join()
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda result: result[1]) == [("result", False), ("result", True)]
@@ -0,0 +1,53 @@
+from functools import lru_cache
+
+import os, tiktoken
+
+DEFAULT_TOKEN_MODEL = "gpt-4o-2024-08-06"
+# Used for models tiktoken does not know about yet
+FALLBACK_ENCODING = os.getenv("TOKEN_FALLBACK_ENCODING", "o200k_base")
+WARM_TOKEN_MODELS = os.getenv("WARM_TOKEN_MODELS", DEFAULT_TOKEN_MODEL).split(",")
+
+
+# Loading an encoding parses a ~2MB BPE table, so each one is built once per process
+@lru_cache(maxsize=None)
+def _get_encoding_by_name(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=64)
+def get_encoding(model: str = DEFAULT_TOKEN_MODEL) -> tiktoken.Encoding:
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = FALLBACK_ENCODING
+    return _get_encoding_by_name(name)
+
+
+def warm_encoders(models: list[str] = WARM_TOKEN_MODELS) -> None:
+    for model in models:
+        get_encoding(model.strip())
+
+
+def estimate_tokens(message: str) -> int:
+    # Byte-level BPE never produces more tokens than UTF-8 bytes, so this is a
+    # cheap upper bound that needs no encoding
+    return len(message.encode("utf-8"))
+
+
+def count_tokens(message: str, model: str = DEFAULT_TOKEN_MODEL) -> int:
+    return len(get_encoding(model).encode_ordinary(message))
+
+
+def count_tokens_many(
+    messages: list[str], model: str = DEFAULT_TOKEN_MODEL, num_threads: int = 4
+) -> list[int]:
+    encoded = get_encoding(model).encode_ordinary_batch(messages, num_threads=num_threads)
+    return [len(tokens) for tokens in encoded]
+
+
+def fits_token_budget(message: str, budget: int, model: str = DEFAULT_TOKEN_MODEL) -> bool:
+    # Most prompt-size guards pass comfortably, so skip the encoder when the
+    # upper bound already fits
+    if estimate_tokens(message) <= budget:
+        return True
+    return count_tokens(message, model) <= budget
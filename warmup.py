@@ -0,0 +1,123 @@
+from asylum_check import (
+    AnswerReason,
+    AnswerReasons,
+    InformationRequests,
+    make_check_answer_prompt,
+    make_check_answers_batch_prompt,
+    make_info_request_prompt,
+)
+from asylum_ruleset import RULE_SETS, SHORT_ANSWER_RULES
+from openai_utils import get_llm_backend, get_openai_client, response_format_param
+from llm_backends import OpenAIBackend, CassetteBackend
+from metrics import get_metrics
+from token_utils import warm_encoders
+from rule_index import get_rule_index
+
+import os, resource, threading, time
+
+# Everything the first request would otherwise pay for. Run once in the
+# gunicorn master before forking (shared copy-on-write with the workers) and
+# again in each worker for the per-process pieces; the readiness endpoint
+# runs it lazily when the app is served some other way.
+
+_lock = threading.Lock()
+_state = {"pid": None, "ready": False, "timings": {}, "errors": {}}
+
+
+def process_start_time() -> float:
+    # Wall-clock start of this process, or of the fork for a gunicorn worker
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat", "r") as f:
+            boot_time = next(float(line.split()[1]) for line in f if line.startswith("btime"))
+    except (OSError, IndexError, StopIteration, ValueError):
+        return None
+    return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        # Peak rather than current, but the best portable fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def uses_openai() -> bool:
+    backend = get_llm_backend()
+    if isinstance(backend, CassetteBackend):
+        return backend.mode != "replay"
+    return isinstance(backend, OpenAIBackend)
+
+
+def warm_openai_client():
+    if not uses_openai():
+        return
+    # Touching the resource attributes triggers the SDK's lazy imports
+    get_openai_client().beta.chat.completions
+
+
+def warm_rule_prompts():
+    for rule_set in RULE_SETS.values():
+        make_check_answer_prompt(rule_set.rendered)
+        make_check_answers_batch_prompt(rule_set.rendered)
+    make_info_request_prompt("")
+    get_rule_index(SHORT_ANSWER_RULES)
+
+
+def warm_response_formats():
+    for format in (AnswerReason, AnswerReasons, InformationRequests):
+        response_format_param(format)
+
+
+WARMUP_STEPS = (
+    ("tiktoken", warm_encoders),
+    ("rule_prompts", warm_rule_prompts),
+    ("response_formats", warm_response_formats),
+    ("openai_client", warm_openai_client),
+)
+
+
+def warm_up() -> dict:
+    # Idempotent per process; a forked worker warms its own client again
+    with _lock:
+        if _state["pid"] == os.getpid() and _state["ready"]:
+            return get_readiness()
+
+        timings, errors = {}, {}
+        for name, step in WARMUP_STEPS:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+            timings[name] = round(time.perf_counter() - start, 4)
+
+        started = process_start_time()
+        if started is not None:
+            timings["since_process_start"] = round(time.time() - started, 4)
+
+        _state.update(pid=os.getpid(), ready=True, timings=timings, errors=errors)
+        return get_readiness()
+
+
+def is_ready() -> bool:
+    return _state["ready"] and _state["pid"] == os.getpid()
+
+
+def get_readiness() -> dict:
+    return {
+        "ready": is_ready(),
+        "pid": os.getpid(),
+        "warmup_seconds": _state["timings"] if is_ready() else {},
+        "warmup_errors": _state["errors"] if is_ready() else {},
+        "rss_mb": round(get_rss_bytes() / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+get_metrics().register_callback(
+    "process_resident_memory_bytes", "gauge", "Resident memory of this worker", get_rss_bytes
+)